@@ -0,0 +1,236 @@
+"""
+Per-cell summary statistics of simulation results, cached next to them.
+"""
+
+import json
+import os
+import numpy as np
+import results
+
+
+class Summary:
+
+
+    """
+    Mean, variance, quantiles, histogram and bootstrap interval of the mean
+    of every metric in every cell.
+
+    Each statistic is a dictionary from metric to an array whose first axis
+    follows cells. Histograms use bins equal-width bins over the range of
+    each cell, like numpy.histogram, so edges has one more column than hist.
+
+    Args:
+        cells [list]: cell keys in row order.
+        metrics [list]: names of the summarized metrics.
+        counts [ndarray]: number of replicates in each cell.
+        quantiles [ndarray]: quantile levels, in (0, 1).
+        stats [dict]: arrays of each statistic, keyed by statistic then
+            metric.
+
+    Attributes:
+        mean [dict]: (cells,) sample means.
+        var [dict]: (cells,) sample variances, NaN below two replicates.
+        quantile [dict]: (cells, quantiles) sample quantiles.
+        hist [dict]: (cells, bins) replicates falling in each bin.
+        edges [dict]: (cells, bins + 1) bin edges.
+        ci [dict]: (cells, 2) bootstrap percentile interval of the mean.
+    """
+
+
+    STATS = ('mean', 'var', 'quantile', 'hist', 'edges', 'ci')
+
+    def __init__(self, cells, metrics, counts, quantiles, stats):
+        """ Store the statistics and index the cells."""
+        self.cells = list(cells)
+        self.metrics = list(metrics)
+        self.counts = np.asarray(counts)
+        self.quantiles = np.asarray(quantiles, dtype=float)
+        self.rows = {key: row for row, key in enumerate(self.cells)}
+        for name in self.STATS:
+            setattr(self, name, stats[name])
+
+    def cell(self, key, metric):
+        """ Dictionary of every statistic of a metric in one cell."""
+        row = self.rows[key]
+        summary = {name: getattr(self, name)[metric][row]
+                for name in self.STATS}
+        summary['count'] = int(self.counts[row])
+        return summary
+
+    def save(self, path, stamp=None):
+        """ Writes the summary to a .npz file, with stamp in its index."""
+        arrays = {'%s.%s' % (name, metric): getattr(self, name)[metric]
+                for name in self.STATS for metric in self.metrics}
+        index = {'cells': self.cells, 'metrics': self.metrics,
+                'quantiles': self.quantiles.tolist(), 'stamp': stamp}
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, index=np.array(json.dumps(index)), counts=self.counts,
+                    **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """ Reads a summary written by save, and the stamp stored with it."""
+        with np.load(path) as f:
+            index = json.loads(f['index'].item())
+            stats = {name: {metric: f['%s.%s' % (name, metric)]
+                            for metric in index['metrics']}
+                    for name in cls.STATS}
+            counts = f['counts']
+        return cls(index['cells'], index['metrics'], counts,
+                index['quantiles'], stats), index['stamp']
+
+
+def load_values(path):
+    """ Cells, metrics, replicate counts and a (metrics, cells, replicates)
+    array of any result format, padded with NaN past each cell's count."""
+    if os.path.isdir(path):
+        columns = results.ColumnarResults(path)
+        cells, metrics, counts = columns.cells, columns.metrics, columns.counts
+        values = np.stack([columns[metric] for metric in metrics])
+        values = values.astype(float)
+    else:
+        if path.endswith('.jsonl'):
+            all_data = results.load_jsonl(path)
+        else:
+            with open(path) as f:
+                all_data = json.load(f)
+        cells = list(all_data)
+        metrics = list(next(runs[0] for runs in all_data.values() if runs))
+        counts = np.array([len(all_data[key]) for key in cells])
+        values = np.zeros((len(metrics), len(cells), int(counts.max())))
+        for row, key in enumerate(cells):
+            values[:, row, :counts[row]] = [[data[metric]
+                                            for data in all_data[key]]
+                                            for metric in metrics]
+
+    values[:, np.arange(values.shape[2]) >= counts[:, None]] = np.nan
+    return cells, metrics, np.asarray(counts), values
+
+
+def histograms(values, counts, bins):
+    """ Per-row histograms over the range of each row, and their edges."""
+    valid = ~np.isnan(values)
+    lo = np.where(valid, values, np.inf).min(axis=-1, initial=np.inf)
+    hi = np.where(valid, values, -np.inf).max(axis=-1, initial=-np.inf)
+    lo = np.where(counts > 0, lo, 0.0)
+    hi = np.where(counts > 0, hi, 0.0)
+    flat = hi == lo
+    lo = np.where(flat, lo - 0.5, lo)
+    hi = np.where(flat, hi + 0.5, hi)
+    edges = lo[..., None] + (hi - lo)[..., None] * np.linspace(0, 1, bins + 1)
+
+    scaled = (values - lo[..., None]) / (hi - lo)[..., None] * bins
+    which = np.clip(np.nan_to_num(scaled), 0, bins - 1).astype(np.int64)
+    rows = np.arange(np.prod(values.shape[:-1])).reshape(values.shape[:-1])
+    flat_bins = (rows[..., None] * bins + which)[valid]
+    hist = np.bincount(flat_bins, minlength=rows.size * bins)
+    return hist.reshape(values.shape[:-1] + (bins,)), edges
+
+
+def bootstrap(values, counts, resamples, confidence, seed=None,
+            max_elements=2**24):
+    """ (metrics, cells, 2) percentile bootstrap intervals of the means.
+
+    Every metric of a cell is resampled with the same replicate indices,
+    in batches of resamples that keep the gathered array under
+    max_elements.
+    """
+    m, c, n = values.shape
+    rng = np.random.default_rng(seed)
+    if n == 0:
+        return np.full((m, c, 2), np.nan)
+
+    batch = max(1, max_elements // (m * c * n))
+    inside = np.arange(n) < counts[:, None, None]
+    total = np.maximum(counts, 1)[:, None]
+    means = []
+    for start in range(0, resamples, batch):
+        draws = min(batch, resamples - start)
+        picks = (rng.random((c, draws, n)) * counts[:, None, None]) \
+                .astype(np.int64)
+        sample = values[:, np.arange(c)[:, None, None], picks]
+        means.append(np.where(inside, sample, 0).sum(-1) / total)
+    means = np.concatenate(means, axis=-1)
+
+    tail = (1 - confidence) / 2
+    ci = np.quantile(means, [tail, 1 - tail], axis=-1)
+    ci[:, :, counts == 0] = np.nan
+    return np.moveaxis(ci, 0, -1)
+
+
+def aggregate(cells, metrics, counts, values, quantiles=(0.05, 0.5, 0.95),
+            bins=10, resamples=1000, confidence=0.95, seed=0):
+    """ Summary of a (metrics, cells, replicates) array padded with NaN."""
+    counts = np.asarray(counts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.nansum(values, axis=-1) / counts
+        var = np.nansum((values - mean[..., None]) ** 2, axis=-1) \
+            / (counts - 1)
+    var[:, counts < 2] = np.nan
+
+    if values.shape[-1] and counts.all():
+        qs = np.moveaxis(np.nanquantile(values, quantiles, axis=-1), 0, -1)
+    else:
+        qs = np.full(values.shape[:-1] + (len(quantiles),), np.nan)
+        for row in np.flatnonzero(counts):
+            qs[:, row] = np.moveaxis(np.nanquantile(values[:, row], quantiles,
+                                                    axis=-1), 0, -1)
+    hist, edges = histograms(values, counts, bins)
+    ci = bootstrap(values, counts, resamples, confidence, seed)
+
+    stats = {'mean': mean, 'var': var, 'quantile': qs, 'hist': hist,
+            'edges': edges, 'ci': ci}
+    stats = {name: dict(zip(metrics, array)) for name, array in stats.items()}
+    return Summary(cells, metrics, counts, quantiles, stats)
+
+
+def summary_path(path):
+    """ File the summary of a result file or columnar directory is kept in."""
+    if os.path.isdir(path):
+        return os.path.join(path, 'summary.npz')
+    return path + '.summary.npz'
+
+
+def source_stamp(path):
+    """ Size and modification time of every file making up the results."""
+    if os.path.isdir(path):
+        names = sorted(name for name in os.listdir(path)
+                    if name.endswith(('.npy', '.json')))
+        files = [os.path.join(path, name) for name in names]
+    else:
+        files = [path]
+    return [[os.path.basename(f), os.stat(f).st_size, os.stat(f).st_mtime_ns]
+            for f in files]
+
+
+def summarize(path, quantiles=(0.05, 0.5, 0.95), bins=10, resamples=1000,
+            confidence=0.95, seed=0, refresh=False):
+    """ Summary of the results at path, read from its cached summary file
+    when that was computed from the same results with the same settings.
+
+    Accepts a json or jsonl file or a directory written by
+    results.save_columnar. The summary is cached with summary_path, and
+    recomputed when the results change or refresh is set.
+    """
+    settings = {'quantiles': list(quantiles), 'bins': bins,
+                'resamples': resamples, 'confidence': confidence, 'seed': seed}
+    stamp = {'source': source_stamp(path), 'settings': settings}
+    cached = summary_path(path)
+    if not refresh and os.path.exists(cached):
+        try:
+            summary, stored = Summary.load(cached)
+        except (OSError, ValueError, KeyError):
+            stored = None
+        if stored == stamp:
+            return summary
+
+    cells, metrics, counts, values = load_values(path)
+    summary = aggregate(cells, metrics, counts, values, quantiles, bins,
+                        resamples, confidence, seed)
+    try:
+        summary.save(cached, stamp)
+    except OSError:
+        pass
+    return summary
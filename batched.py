@@ -0,0 +1,163 @@
+"""
+Engine that advances many independent replicates of the model together.
+"""
+
+import numpy as np
+import epidemic
+import graph
+import profiling
+
+
+class BatchedEpidemic(epidemic.CSREpidemic):
+
+
+    """
+    Replicates of the synchronous model advanced together as one network.
+
+    The networks of all replicates are laid side by side as a single block
+    diagonal CSRGraph, node r * size + i being node i of replicate r. Since
+    no edge crosses blocks, one synchronous tick over the combined network
+    is one synchronous tick of every replicate, done with a handful of large
+    array operations instead of a Python loop per replicate. Only the death
+    probability, which depends on each replicate's own infected count, and
+    the counters are kept per replicate.
+
+    Args:
+        replicates [int]: Number of replicates to run together.
+        size [int]: Number of nodes in the network of each replicate.
+        p_infect [float]: probability a node gets infected from another node.
+        p_die [float]: probability an infected node is removed from the network.
+        init_infect [float]: initial infection rate of nodes.
+        mode [str]: update semantics, only 'synchronous' is supported.
+        seed [int]: seed, SeedSequence or Generator for every random draw.
+        record_steps [int]: number of ticks whose counters are kept in
+            tseries, 0 disables recording.
+        topology [list]: one (E, 2) edge array per replicate, or a single
+            edge array shared by all of them.
+        profile [bool]: whether to time the phases of update() and count
+            events over the whole batch.
+
+    Attributes:
+        replicates [int]: Number of replicates run together.
+        size [int]: Number of nodes in the network of each replicate.
+        counts [ndarray]: (replicates, 5) counters, columns ordered as METRICS.
+        stop_ticks [ndarray]: tick each replicate ran out of infections at.
+        tseries [ndarray]: (replicates, record_steps, 5) counters per tick,
+            or None when not recording.
+    """
+
+
+    MODES = ('synchronous',)
+
+    def __init__(self, replicates, size, p_infect=0.2, p_die=0.01,
+                init_infect=0.01, mode=None, seed=None, record_steps=0,
+                topology=None, profile=False):
+        """ Lay out every replicate's network and set initial infected."""
+        if mode not in (None,) + self.MODES:
+            raise ValueError("%s does not support the %r update mode"
+                            % (type(self).__name__, mode))
+
+        self.mode = self.MODES[0]
+        self.profiler = profiling.Profiler() if profile else None
+        self.rng = np.random.default_rng(seed)
+        self._uniforms = []
+        self.replicates = replicates
+        self.size = size
+        self.g = self.make_graph(size, topology)
+        self.p_infect = p_infect
+        self.p_die = p_die
+        self.capacity = size // 4
+
+        self.set_patient0(init_infect)
+        infected = np.count_nonzero(self.state.reshape(replicates, size) > 0,
+                                    axis=1)
+        self.counts = np.zeros((replicates, len(epidemic.METRICS)),
+                                dtype=np.int64)
+        self.counts[:, self.column('alive')] = size
+        self.counts[:, self.column('susceptible')] = size - infected
+        self.counts[:, self.column('infected')] = infected
+        self.stop_ticks = np.where(infected == 0, 0, -1)
+        self.stopped = False
+
+        self.tick = 0
+        self.tseries = None
+        if record_steps:
+            self.tseries = np.zeros((replicates, record_steps,
+                                    len(epidemic.METRICS)), dtype=np.int32)
+
+    def make_graph(self, size, topology=None):
+        """ Block diagonal CSRGraph holding the network of every replicate."""
+        if topology is None:
+            topology = [graph.barabasi_albert_edges(size, 2, self.graph_seed())
+                        for r in range(self.replicates)]
+        elif np.ndim(topology) == 2:
+            topology = [topology] * self.replicates
+
+        edges = np.concatenate([np.asarray(e, dtype=np.int64) + r * size
+                                for r, e in enumerate(topology)])
+        return graph.CSRGraph(self.replicates * size, edges)
+
+    @staticmethod
+    def column(metric):
+        """ Column of counts holding a metric."""
+        return epidemic.METRICS.index(metric)
+
+    @property
+    def data(self):
+        """ Counters of each replicate, as Epidemic.data dicts."""
+        data = [dict(zip(epidemic.METRICS, row.tolist()))
+                for row in self.counts]
+        if self.stopped:
+            stop = np.where(self.stop_ticks < 0, self.tick, self.stop_ticks)
+            for d, tick in zip(data, stop.tolist()):
+                d['stop_tick'] = tick
+
+        return data
+
+    def run(self, len_of_sims, conformity, crowd_thresh, stop_early=False):
+        """ Applies len_of_sims updates, optionally stopping once absorbed.
+
+        Replicates that run out of infections stay frozen while the others
+        continue, so stopping early only ends the run once every replicate
+        is done. data then reports the tick each replicate stopped at.
+        """
+        for l in range(len_of_sims):
+            if stop_early and self.absorbed():
+                break
+            self.update(conformity, crowd_thresh)
+
+        if stop_early:
+            self.stopped = True
+            if self.tseries is not None:
+                self.tseries[:, self.tick:] = self.counts[:, None]
+
+    def absorbed(self):
+        """ Whether every replicate is out of infections."""
+        return not self.counts[:, self.column('infected')].any()
+
+    def record(self):
+        """ Stores the counters of the tick that just finished in tseries."""
+        if self.tseries is not None and self.tick < self.tseries.shape[1]:
+            self.tseries[:, self.tick] = self.counts
+        self.tick += 1
+
+        infected = self.counts[:, self.column('infected')]
+        self.stop_ticks[(infected == 0) & (self.stop_ticks < 0)] = self.tick
+
+    def death_probs(self, infected):
+        """ Death probability of each infected node, set by its replicate."""
+        crowded = self.counts[:, self.column('infected')] > self.capacity
+        p_die = np.where(crowded, 4*self.p_die, self.p_die)
+        return p_die[infected // self.size]
+
+    def tally(self, dead, recovered, caught):
+        """ Adds the transitions of a synchronous tick to each replicate."""
+        dead, recovered, caught = [np.bincount(nodes // self.size,
+                                    minlength=self.replicates)
+                                    for nodes in (dead, recovered, caught)]
+
+        self.counts[:, self.column('dead')] += dead
+        self.counts[:, self.column('alive')] -= dead
+        self.counts[:, self.column('recovered')] += recovered
+        self.counts[:, self.column('infected')] += caught - dead - recovered
+        self.counts[:, self.column('susceptible')] -= caught
@@ -0,0 +1,220 @@
+"""
+Benchmarks for the epidemic backends and the Simulations sweep.
+
+Run with `python -m bench`; results are printed as JSON, or appended as one
+JSON line per run to the file given with --output so runs can be compared
+over time.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+import networkx as nx
+import epidemic
+import simulations
+
+SETTINGS = {'open': (0.0, 5),
+            'distancing': (0.6, 2),
+            'lockdown': (1.0, 1)
+            }
+
+
+def bench_epidemic(backend, mode, size, setting, ticks, seed):
+    """ Times building one epidemic and running it for ticks updates."""
+    conformity, crowd = SETTINGS[setting]
+    model = simulations.BACKENDS[backend]
+
+    start = time.perf_counter()
+    E = model(size, mode=mode, seed=seed)
+    built = time.perf_counter()
+    for l in range(ticks):
+        E.update(conformity, crowd)
+    done = time.perf_counter()
+
+    return {'bench': 'epidemic',
+            'backend': backend,
+            'mode': E.mode,
+            'size': size,
+            'setting': setting,
+            'ticks': ticks,
+            'build_seconds': built - start,
+            'run_seconds': done - built,
+            'ticks_per_second': ticks / (done - built),
+            'replicates_per_second': 1 / (done - start)
+            }
+
+
+def bench_batched(size, replicates, setting, ticks, seed):
+    """ Times the batched engine advancing many replicates together."""
+    conformity, crowd = SETTINGS[setting]
+    model = simulations.BACKENDS['batched']
+
+    start = time.perf_counter()
+    E = model(replicates, size, seed=seed)
+    built = time.perf_counter()
+    for l in range(ticks):
+        E.update(conformity, crowd)
+    done = time.perf_counter()
+
+    return {'bench': 'batched',
+            'backend': 'batched',
+            'mode': E.mode,
+            'size': size,
+            'replicates': replicates,
+            'setting': setting,
+            'ticks': ticks,
+            'build_seconds': built - start,
+            'run_seconds': done - built,
+            'ticks_per_second': ticks / (done - built),
+            'replicates_per_second': replicates / (done - start)
+            }
+
+
+def bench_sweep(backend, mode, size, num_of_sims, ticks, workers, seed):
+    """ Times a full Simulations sweep over the 5x5 grid."""
+    start = time.perf_counter()
+    simulations.Simulations(size, num_of_sims, ticks, backend=backend,
+                            mode=mode, workers=workers, seed=seed,
+                            progress=False).run_all()
+    done = time.perf_counter()
+
+    return {'bench': 'sweep',
+            'backend': backend,
+            'mode': mode,
+            'size': size,
+            'num_of_sims': num_of_sims,
+            'ticks': ticks,
+            'workers': workers,
+            'seconds': done - start,
+            'replicates_per_second': 25 * num_of_sims / (done - start)
+            }
+
+
+def bench_memory(size, mode, setting, ticks, seed, ceiling_mb):
+    """ Peak memory of a LeanEpidemic over ticks updates, against a ceiling.
+
+    Tracing covers generating the network as well as the model's own arrays
+    and the temporaries of its updates.
+    """
+    conformity, crowd = SETTINGS[setting]
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    E = epidemic.LeanEpidemic(size, mode=mode, seed=seed)
+    built, build_peak = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    for l in range(ticks):
+        E.update(conformity, crowd)
+    done = time.perf_counter()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'bench': 'memory',
+            'backend': 'lean',
+            'mode': E.mode,
+            'size': size,
+            'setting': setting,
+            'ticks': ticks,
+            'seconds': done - start,
+            'bytes_per_node': built / size,
+            'build_peak_mb': build_peak / 2**20,
+            'run_peak_mb': peak / 2**20,
+            'ceiling_mb': ceiling_mb,
+            'within_ceiling': max(build_peak, peak) <= ceiling_mb * 2**20
+            }
+
+
+def environment():
+    """ Describes the machine and code version the benchmarks ran on."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'],
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+
+    return {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': commit or None,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'networkx': nx.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor()
+            }
+
+
+def parse_engine(text):
+    """ Splits 'backend' or 'backend:mode' into its two parts."""
+    backend, _, mode = text.partition(':')
+    return backend, mode or None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--sizes', type=int, nargs='*',
+                        default=[1000, 5000, 50000])
+    parser.add_argument('--engines', nargs='*',
+                        default=['networkx', 'csr:sequential', 'csr:frontier',
+                                'csr:synchronous', 'gillespie'],
+                        help="backend or backend:mode pairs to measure")
+    parser.add_argument('--settings', nargs='+', default=list(SETTINGS),
+                        choices=list(SETTINGS))
+    parser.add_argument('--ticks', type=int, default=20)
+    parser.add_argument('--replicates', type=int, default=20,
+                        help="replicates per batch for the batched engine")
+    parser.add_argument('--sweep-size', type=int, default=500)
+    parser.add_argument('--sweep-sims', type=int, default=2)
+    parser.add_argument('--sweep-engines', nargs='*',
+                        default=['networkx', 'csr:frontier', 'batched'])
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--memory', action='store_true',
+                        help="also check the memory-lean backend against "
+                            "--memory-ceiling, failing if it is exceeded")
+    parser.add_argument('--memory-size', type=int, default=1000000)
+    parser.add_argument('--memory-ticks', type=int, default=50)
+    parser.add_argument('--memory-mode', default='synchronous')
+    parser.add_argument('--memory-ceiling', type=float, default=256,
+                        help="MiB the lean backend may allocate at its peak")
+    parser.add_argument('--output', help="JSON Lines file to append to")
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in args.sizes:
+        for setting in args.settings:
+            for engine in args.engines:
+                backend, mode = parse_engine(engine)
+                results.append(bench_epidemic(backend, mode, size, setting,
+                                            args.ticks, args.seed))
+            results.append(bench_batched(size, args.replicates, setting,
+                                        args.ticks, args.seed))
+
+    for engine in args.sweep_engines:
+        backend, mode = parse_engine(engine)
+        results.append(bench_sweep(backend, mode, args.sweep_size,
+                                args.sweep_sims, args.ticks, args.workers,
+                                args.seed))
+
+    if args.memory:
+        results.append(bench_memory(args.memory_size, args.memory_mode,
+                                    'distancing', args.memory_ticks,
+                                    args.seed, args.memory_ceiling))
+
+    report = {'environment': environment(), 'results': results}
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(report) + '\n')
+    else:
+        print(json.dumps(report, indent=4))
+
+    if not all(r.get('within_ceiling', True) for r in results):
+        raise SystemExit("memory ceiling exceeded")
+
+
+if __name__ == '__main__':
+    main()
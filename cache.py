@@ -0,0 +1,164 @@
+"""
+On-disk cache of finished tasks so overlapping sweeps skip recomputation.
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import tempfile
+import batched
+import epidemic
+import gillespie
+import graph
+
+MODEL_MODULES = (epidemic, graph, gillespie, batched)
+
+
+def source_fingerprint():
+    """ Hash of the source of every module that shapes simulation output."""
+    digest = hashlib.sha256()
+    for module in MODEL_MODULES:
+        digest.update(inspect.getsource(module).encode())
+    return digest.hexdigest()
+
+
+def task_key(task, version):
+    """ Hash of version and the parts of a task that determine its output."""
+    seed = task['seed']
+    material = {'version': version,
+                'backend': task['backend'],
+                'mode': task['mode'],
+                'size': task['size'],
+                'p_infect': task['p_infect'],
+                'p_die': task['p_die'],
+                'init_infect': task['init_infect'],
+                'conformity': task['conformity'],
+                'crowd': task['crowd'],
+                'len_of_sims': task['len_of_sims'],
+                'record': task['record'],
+                'stop_early': task['stop_early'],
+                'profile': task['profile'],
+                'replicates': len(task['replicates']),
+                'topology': topology_key(task['topology']),
+                'seed': [str(seed.entropy), list(seed.spawn_key)]
+                }
+    return hashlib.sha256(json.dumps(material, sort_keys=True)
+                        .encode()).hexdigest()
+
+
+def topology_key(topology):
+    """ Pool file, index and content hash of each pooled graph of a task,
+    so regenerating a pool in place invalidates its entries."""
+    if topology is None:
+        return None
+
+    digests = {}
+    for path, k in topology:
+        if (path, k) not in digests:
+            edges = graph.load_pool(path)[k]
+            digests[path, k] = hashlib.sha256(edges.tobytes()).hexdigest()
+    return [[path, k, digests[path, k]] for path, k in topology]
+
+
+class ResultCache:
+
+
+    """
+    Content-addressed store of task outputs with size-bounded LRU eviction.
+
+    An entry is keyed by the hash of everything that determines a task's
+    output: backend, mode, parameters, number of ticks, the contents of the
+    pooled graphs, seed and whether it was profiled, together with
+    epidemic.MODEL_VERSION.
+    MODEL_VERSION is bumped by hand whenever the model's behaviour changes;
+    with strict set, a fingerprint of the model source is also part of the
+    key, so any edit to the model code invalidates the cache without having
+    to remember the bump. Stale entries are never read again and age out
+    through eviction.
+
+    Entries are the pickled (runs, report) outcomes of run_task, named by
+    their key. Reading an entry touches its modification time, and once the
+    files exceed max_bytes the least recently used ones are deleted.
+
+    Args:
+        path [str]: directory holding the entries, created when missing.
+        max_bytes [int]: size the cache is trimmed back to, None for no limit.
+        strict [bool]: include the model source fingerprint in the keys.
+
+    Attributes:
+        path [str]: directory holding the entries.
+        version [str]: model version and fingerprint mixed into every key.
+        hits [int]: number of lookups answered from the cache.
+        misses [int]: number of lookups that were not.
+    """
+
+
+    def __init__(self, path, max_bytes=2**30, strict=True):
+        """ Open the cache directory and measure what it already holds."""
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.version = str(epidemic.MODEL_VERSION)
+        if strict:
+            self.version += '-' + source_fingerprint()
+        self.hits = 0
+        self.misses = 0
+        self.bytes = sum(os.path.getsize(f) for f in self.entries())
+
+    def entries(self):
+        """ Paths of every stored entry."""
+        return [os.path.join(self.path, name) for name in os.listdir(self.path)
+                if name.endswith('.pkl')]
+
+    def key(self, task):
+        """ Hash of the parts of a task that determine its output."""
+        return task_key(task, self.version)
+
+    def entry(self, key):
+        """ Path of the entry stored under key."""
+        return os.path.join(self.path, key + '.pkl')
+
+    def get(self, task):
+        """ Stored outcome of the task, or None when it has not been cached."""
+        path = self.entry(self.key(task))
+        try:
+            with open(path, 'rb') as f:
+                outcome = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+
+        os.utime(path)
+        self.hits += 1
+        return outcome
+
+    def put(self, task, outcome):
+        """ Store the outcome of a task and evict old entries if over
+        budget."""
+        path = self.entry(self.key(task))
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(outcome, f, protocol=pickle.HIGHEST_PROTOCOL)
+        if os.path.exists(path):
+            self.bytes -= os.path.getsize(path)
+        os.replace(tmp, path)
+        self.bytes += os.path.getsize(path)
+
+        if self.max_bytes is not None and self.bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """ Delete least recently used entries until under max_bytes."""
+        for path in sorted(self.entries(), key=os.path.getmtime):
+            if self.bytes <= self.max_bytes:
+                break
+            self.bytes -= os.path.getsize(path)
+            os.remove(path)
+
+    def clear(self):
+        """ Delete every entry."""
+        for path in self.entries():
+            os.remove(path)
+        self.bytes = 0
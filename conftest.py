@@ -0,0 +1,3 @@
+def pytest_configure(config):
+    config.addinivalue_line('markers', "slow: takes tens of seconds, "
+                            "deselect with -m 'not slow'")
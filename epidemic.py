@@ -4,9 +4,20 @@ by Dr. Hiroki Sayama and his 'SSIE 641: Advanced Topics in Network Science'
 class on March 11, 2020.
 """
 
+import heapq
 import numpy as np
 import networkx as nx
-from random import random
+import graph
+import profiling
+
+SUSCEPTIBLE = 0
+RECOVERED = -1
+DEAD = -2
+
+METRICS = ('dead', 'alive', 'susceptible', 'infected', 'recovered')
+
+# Bump whenever a change alters simulation output, to invalidate cached runs.
+MODEL_VERSION = 5
 
 
 class Epidemic:
@@ -20,6 +31,14 @@ class Epidemic:
         p_infect [float]: probability a node gets infected from another node.
         p_die [float]: probability an infected node is removed from the network.
         init_infect [float]: initial infection rate of nodes.
+        mode [str]: update semantics, one of MODES, the first by default.
+        seed [int]: seed, SeedSequence or Generator for every random draw.
+        record_steps [int]: number of ticks whose counters are kept in
+            tseries, 0 disables recording.
+        topology [ndarray]: (E, 2) edges to use instead of generating a new
+            Barabasi-Albert graph, see graph.GraphPool.
+        profile [bool]: whether to time the phases of update() and count
+            events, see profiling.Profiler.
 
     Attributes:
         g [Graph]: Barabasi-Albert random network representing interactions.
@@ -27,12 +46,65 @@ class Epidemic:
         p_die [float]: probability an infected node is removed from the network.
         capacity [int]: represents healthcare capacity at 1/4 total population.
         data [dict]: stores information about the simulation at each time step.
+        mode [str]: update semantics used by update().
+        rng [Generator]: source of every random draw in the simulation.
+        tick [int]: number of updates applied so far.
+        tseries [ndarray]: (record_steps, 5) counters after each tick, with
+            columns ordered as METRICS, or None when not recording.
+        profiler [Profiler]: phase timings and event counts, or None.
+        links [CSRGraph]: the initial edges, giving every (node, neighbor)
+            pair a fixed slot.
+        severed [ndarray]: mask of the slots whose edge their node cut when
+            isolating and may restore later.
+        isolated [ndarray]: number of severed slots of every node.
+        dead [ndarray]: mask of the dead nodes.
+        tombstones [int]: dead nodes still taking up room in g.
+
+    Deaths:
+        A node that dies is only marked in dead and left in g with its
+        edges as a tombstone, which every rule skips. Removing nodes one by
+        one from networkx costs a teardown of their adjacency dicts in the
+        middle of a sweep; instead tidy() drops all tombstones in one go
+        between ticks once they exceed COMPACT_FRACTION of the nodes.
+
+    Isolation:
+        A susceptible node with at least crowd_thresh infected neighbors cuts
+        each of its edges with probability conformity and remembers the cut
+        edges in severed. Every tick a recovered node, or a susceptible node
+        below crowd_thresh, restores one of its cut edges at random, unless
+        the neighbor has died, in which case the edge is just forgotten.
+
+    Update modes:
+        sequential: nodes are visited one at a time in a fresh random order
+            every tick, and each node sees the changes made by the nodes
+            visited before it. This is the original model.
+        synchronous: every node reads the state at the start of the tick and
+            all transitions are applied together. Update order no longer
+            matters, which lets array backends process a tick in bulk.
+        frontier: same semantics as sequential, but only the nodes that can
+            change (infected nodes and susceptible nodes next to infection)
+            are visited, still in random order.
     """
 
 
-    def __init__(self, size, p_infect=0.2, p_die=0.01, init_infect=0.01):
+    MODES = ('sequential',)
+    COMPACT_FRACTION = 0.1
+
+    def __init__(self, size, p_infect=0.2, p_die=0.01, init_infect=0.01,
+                mode=None, seed=None, record_steps=0, topology=None,
+                profile=False):
         """ Initialize barabasi random network and set initial infected."""
-        self.g = nx.barabasi_albert_graph(size, 2)
+        if mode is None:
+            mode = self.MODES[0]
+        if mode not in self.MODES:
+            raise ValueError("%s does not support the %r update mode"
+                            % (type(self).__name__, mode))
+
+        self.mode = mode
+        self.profiler = profiling.Profiler() if profile else None
+        self.rng = np.random.default_rng(seed)
+        self._uniforms = []
+        self.g = self.make_graph(size, topology)
         self.p_infect = p_infect
         self.p_die = p_die
         self.capacity = size // 4
@@ -45,82 +117,208 @@ class Epidemic:
                     'recovered': 0
                     }
 
+        self.tick = 0
+        self.tseries = None
+        if record_steps:
+            self.tseries = np.zeros((record_steps, len(METRICS)),
+                                    dtype=np.int32)
+
+    def make_graph(self, size, topology=None):
+        """ Build the Barabasi-Albert interaction network."""
+        if topology is None:
+            topology = graph.barabasi_albert_edges(size, 2, self.graph_seed())
+
+        g = nx.empty_graph(size)
+        g.add_edges_from(np.asarray(topology).tolist())
+        return g
+
+    def graph_seed(self):
+        """ Integer seed for networkx, drawn from the simulation's rng."""
+        return int(self.rng.integers(2**32))
+
+    def random(self):
+        """ Next uniform draw from rng, served from a pre-drawn block."""
+        if not self._uniforms:
+            self._uniforms = self.rng.random(4096).tolist()
+        return self._uniforms.pop()
+
     def set_patient0(self, init_infect):
         """ Set initial infected population based on provided initial rate"""
         accum = 0
         for i in self.g.nodes:
-            if random()  < init_infect:
+            if self.random() < init_infect:
                 self.g.nodes[i]['state'] = 1
                 accum += 1
             else:
                 self.g.nodes[i]['state'] = 0
 
+        self.links = graph.CSRGraph.from_networkx(self.g)
+        self.severed = np.zeros(len(self.links.indices), dtype=bool)
+        self.isolated = np.zeros(self.links.size, dtype=np.int32)
+        self.dead = np.zeros(self.links.size, dtype=bool)
+        self.tombstones = 0
+
         return accum
 
     def update(self, conformity, crowd_thresh):
+        """ Advances the simulation by one tick in the configured mode."""
+        if self.profiler is None:
+            getattr(self, 'update_' + self.mode)(conformity, crowd_thresh)
+            self.tidy()
+        else:
+            self.profiler.start()
+            getattr(self, 'update_' + self.mode)(conformity, crowd_thresh)
+            self.profiler.lap('other')
+            self.tidy()
+            self.profiler.lap('compaction')
+            self.profiler.end_tick()
+        self.record()
+
+    def tidy(self):
+        """ Drops the tombstones from g once enough of them have piled up."""
+        if self.tombstones > self.COMPACT_FRACTION * len(self.dead):
+            self.g.remove_nodes_from(np.flatnonzero(self.dead).tolist())
+            self.tombstones = 0
+
+    def run(self, len_of_sims, conformity, crowd_thresh, stop_early=False):
+        """ Applies len_of_sims updates, optionally stopping once absorbed.
+
+        With stop_early set, the run ends as soon as no node is infected and
+        the tick it stopped at is stored in data['stop_tick']. From then on
+        no counter can change, so the skipped ticks are filled into tseries
+        with the final counters.
+        """
+        for l in range(len_of_sims):
+            if stop_early and self.absorbed():
+                break
+            self.update(conformity, crowd_thresh)
+
+        if stop_early:
+            self.data['stop_tick'] = self.tick
+            if self.tseries is not None:
+                self.tseries[self.tick:] = [self.data[m] for m in METRICS]
+
+    def absorbed(self):
+        """ Whether the epidemic is over, leaving every counter fixed."""
+        return self.data['infected'] == 0
+
+    def record(self):
+        """ Stores the counters of the tick that just finished in tseries."""
+        if self.tseries is not None and self.tick < len(self.tseries):
+            self.tseries[self.tick] = [self.data[m] for m in METRICS]
+        self.tick += 1
+
+    def update_sequential(self, conformity, crowd_thresh):
         """ Changes node state and edges based on neighbors and self status."""
+        prof = self.profiler
         node_IDs = list(self.g.nodes)
-        np.random.shuffle(node_IDs)
+        self.rng.shuffle(node_IDs)
+        if prof:
+            prof.lap('shuffle')
 
         for i in node_IDs:
+            if self.dead[i]:
+                continue
+
             # IF INFECTED
             if self.g.nodes[i]['state'] > 0.5:
 
-                if random() < self.death_prob():
-                    self.g.remove_node(i)
+                if self.random() < self.death_prob():
+                    if prof:
+                        prof.count('deaths')
+                    self.g.nodes[i]['state'] = DEAD
+                    self.dead[i] = True
+                    self.tombstones += 1
                     self.data['dead'] += 1
                     self.data['alive'] -= 1
                     self.data['infected'] -= 1
+                    if prof:
+                        prof.lap('death')
 
-                elif random() < self.recov_prob(i):
+                elif self.random() < self.recov_prob(i):
                     self.g.nodes[i]['state'] = 0.5
                     self.data['recovered'] += 1
                     self.data['infected'] -= 1
+                    if prof:
+                        prof.count('recoveries')
+                        prof.lap('recovery')
 
                 else:
                     self.g.nodes[i]['state'] += 1
+                    if prof:
+                        prof.lap('infected')
 
             # IF RECOVERED
             elif self.g.nodes[i]['state'] > 0:
-                if 'neighbors' in self.g.nodes[i]:
-                    if len(self.g.nodes[i]['neighbors']) > 0:
-                        # Exit Isolation
-                        j = np.random.choice(self.g.nodes[i]['neighbors'])
-                        if j in self.g.nodes:
-                            self.g.add_edge(i, j)
+                if self.isolated[i]:
+                    # Exit Isolation
+                    if self.reconnect(i) and prof:
+                        prof.count('reconnections')
+                if prof:
+                    prof.lap('recovered')
 
             # IF SUSCEPTIBLE
             else:
                 num_inf_nbs = len([1 for j in self.g.neighbors(i)\
                                 if self.g.nodes[j]['state'] > 0.5])
+                if prof:
+                    prof.count('neighbor_scans', self.g.degree(i))
+                    prof.lap('neighbor_scan')
 
-                if random() < self.infection_prob(num_inf_nbs):
+                if self.random() < self.infection_prob(num_inf_nbs):
                     # Node i gets infected
                     self.g.nodes[i]['state'] = 1
                     self.data['infected'] += 1
                     self.data['susceptible'] -= 1
+                    if prof:
+                        prof.count('infections')
 
                 else:
                     # Node i does not get infected
                     self.g.nodes[i]['state'] = self.g.nodes[i]['state']
 
                 # Exit Isolation
-                if 'neighbors' in self.g.nodes[i]:
-                    if len(self.g.nodes[i]['neighbors']) > 0:
-                        if hum_inf_nbs < crowd_thresh:
-                            j = choice(self.g.nodes[i]['neighbors'])
-
-                            if j in self.g.nodes:
-                                self.g.add_edge(i, j)
+                if self.isolated[i] and num_inf_nbs < crowd_thresh:
+                    if self.reconnect(i) and prof:
+                        prof.count('reconnections')
+                if prof:
+                    prof.lap('infection')
 
                 # Enter Isolation
                 if num_inf_nbs >= crowd_thresh:
-                    past_neighbors = list(self.g.neighbors(i))
+                    start = self.links.indptr[i]
+                    stop = self.links.indptr[i + 1]
+                    adjacent = self.g.adj[i]
 
-                    for neighbor in past_neighbors:
-                        if random() < conformity:
+                    for slot in range(start, stop):
+                        neighbor = self.links.indices[slot]
+                        if neighbor in adjacent and not self.dead[neighbor] \
+                                and self.random() < conformity:
                             self.g.remove_edge(i, neighbor)
-                            self.g.nodes[i]['past_neighbors'] = past_neighbors
+                            self.severed[slot] = True
+                            self.isolated[i] += 1
+                            if prof:
+                                prof.count('isolation_edges')
+                    if prof:
+                        prof.lap('isolation')
+
+    def reconnect(self, i):
+        """ Restores one random edge node i cut while isolating.
+
+        The edge is forgotten either way; returns False when its far end
+        has died in the meantime and there was nothing to restore.
+        """
+        start, stop = self.links.indptr[i], self.links.indptr[i + 1]
+        slots = start + np.flatnonzero(self.severed[start:stop])
+        slot = slots[int(self.random() * len(slots))]
+        self.severed[slot] = False
+        self.isolated[i] -= 1
+
+        j = int(self.links.indices[slot])
+        if self.dead[j]:
+            return False
+        self.g.add_edge(i, j)
+        return True
 
     def death_prob(self):
         """ Death probability mult. by 4 if healthcare capacity is exceeded."""
@@ -136,3 +334,426 @@ class Epidemic:
     def infection_prob(self, neighbors):
         """ Binomial distribution based on the number of infected neighbors."""
         return 1 - (1 - self.p_infect)**neighbors
+
+
+class CSREpidemic(Epidemic):
+
+
+    """
+    Epidemic model backed by NumPy arrays instead of networkx attributes.
+
+    Node states live in a single int8 array and the network is a CSRGraph,
+    so a tick reads neighbor states with array slices rather than dict
+    lookups. In sequential mode the update rules and their order match
+    Epidemic exactly. Synchronous mode draws all transitions as batched
+    arrays and applies them together.
+
+    The number of infected neighbors of every node is kept in inf_nbs and
+    adjusted whenever a node is infected, recovers or dies and whenever an
+    edge is cut or restored, so no tick has to rescan the neighbors of every
+    node. Cut edges stay in g with their slots cleared in g.active, so g is
+    also the links of Epidemic and severed is indexed by its slots.
+
+    A dead node is only marked in state and its edges cleared in g.active,
+    leaving their slots in every later row scan. tidy() compacts them out
+    of g between ticks once the dead since the last compaction exceed
+    COMPACT_FRACTION of the nodes.
+
+    States are encoded as SUSCEPTIBLE (0), RECOVERED (-1), DEAD (-2), and any
+    positive value for an infected node, counting its days of infection.
+
+    Attributes:
+        g [CSRGraph]: array-backed Barabasi-Albert interaction network.
+        state [ndarray]: current state code of every node.
+        inf_nbs [ndarray]: number of infected neighbors of every node.
+        severed [ndarray]: mask of the slots of g whose edge their node cut
+            when isolating.
+        isolated [ndarray]: number of severed slots of every node.
+        tombstones [int]: nodes that died since g was last compacted.
+    """
+
+
+    MODES = ('sequential', 'synchronous', 'frontier')
+    INDEX_DTYPE = np.int64
+    COUNT_DTYPES = (np.int32,)
+
+    def make_graph(self, size, topology=None):
+        """ Build the Barabasi-Albert network directly as CSR arrays.
+
+        topology may also be a CSRGraph, which is used as is, so callers can
+        hand over a GraphPool.csr copy that shares its structure.
+        """
+        if isinstance(topology, graph.CSRGraph):
+            return topology
+        if topology is None:
+            topology = graph.barabasi_albert_edges(size, 2, self.graph_seed())
+        return graph.CSRGraph(size, topology, self.INDEX_DTYPE)
+
+    def count_dtype(self):
+        """ First of COUNT_DTYPES that can count every neighbor of a node."""
+        degree = int(np.diff(self.g.indptr).max(initial=0))
+        for dtype in self.COUNT_DTYPES:
+            if degree <= np.iinfo(dtype).max:
+                return dtype
+        return np.int64
+
+    def set_patient0(self, init_infect):
+        """ Set initial infected population based on provided initial rate"""
+        infected = self.rng.random(self.g.size) < init_infect
+        self.state = infected.astype(np.int8)
+        counts = self.count_dtype()
+        self.inf_nbs = self.g.matvec(infected).astype(counts)
+        self.links = self.g
+        self.severed = np.zeros(len(self.g.indices), dtype=bool)
+        self.isolated = np.zeros(self.g.size, dtype=counts)
+        self.tombstones = 0
+        degree = int(np.diff(self.g.indptr).max(initial=0))
+        self.infection_probs = [self.infection_prob(k)
+                                for k in range(degree + 1)]
+
+        return int(np.count_nonzero(self.state))
+
+    def tidy(self):
+        """ Compacts the slots of dead nodes out of g once enough piled up."""
+        if self.tombstones <= self.COMPACT_FRACTION * self.g.size:
+            return
+
+        # Severed slots stay until their owner draws them in reconnect.
+        owners = np.repeat(np.arange(self.g.size, dtype=self.g.indptr.dtype),
+                        np.diff(self.g.indptr))
+        keep = ((self.state[owners] != DEAD)
+                & (self.state[self.g.indices] != DEAD)) \
+                | self.severed | self.severed[self.g.twin]
+        self.remap(keep, self.g.compact(keep))
+        self.tombstones = 0
+
+    def remap(self, keep, new):
+        """ Carries per-slot state over to the slots of the compacted g."""
+        self.severed = self.severed[keep]
+
+    def update_sequential(self, conformity, crowd_thresh):
+        """ Visit nodes one at a time in random order, as Epidemic does.
+
+        A susceptible node with no infected neighbor and no cut edge can
+        only draw its zero chance of infection, so unless it isolates at a
+        crowd_thresh of 0 the draw is made here without a call to visit. A
+        recovered node without cut edges has nothing to do at all. A node's
+        state and cut edges only change on its own visit, so both are read
+        from lists taken at the start of the sweep.
+        """
+        inf_nbs, random = self.inf_nbs, self.random
+        node_IDs = np.flatnonzero(self.state != DEAD)
+        self.rng.shuffle(node_IDs)
+        if self.profiler:
+            self.profiler.lap('shuffle')
+
+        if crowd_thresh <= 0 or self.profiler:
+            for i in node_IDs.tolist():
+                self.visit(i, conformity, crowd_thresh)
+            return
+
+        states, isolated = self.state.tolist(), self.isolated.tolist()
+        for i in node_IDs.tolist():
+            if not isolated[i]:
+                s = states[i]
+                if s == RECOVERED:
+                    continue
+                if s == SUSCEPTIBLE and not inf_nbs.item(i):
+                    random()
+                    continue
+            self.visit(i, conformity, crowd_thresh)
+
+    def update_frontier(self, conformity, crowd_thresh):
+        """ Sequential sweep that only visits nodes able to change.
+
+        Visiting nodes by increasing uniform random key is the same as
+        visiting them in a random order. Only the frontier gets a key up
+        front; a susceptible node that gains an infected neighbor during the
+        sweep draws its key then, and is visited only if the key is still
+        ahead of the sweep. Otherwise its turn has passed while it had
+        nothing to react to, exactly as in the full sweep.
+        """
+        state = self.state
+        frontier = self.frontier(crowd_thresh)
+        keyed = np.zeros(len(state), dtype=bool)
+        keyed[frontier] = True
+
+        heap = list(zip(self.rng.random(len(frontier)).tolist(),
+                        frontier.tolist()))
+        heapq.heapify(heap)
+        if self.profiler:
+            self.profiler.count('frontier', len(frontier))
+            self.profiler.lap('frontier')
+
+        while heap:
+            key, i = heapq.heappop(heap)
+            if not self.visit(i, conformity, crowd_thresh):
+                continue
+
+            for j in self.g.neighbors(i).tolist():
+                if not keyed[j] and state[j] == SUSCEPTIBLE:
+                    keyed[j] = True
+                    turn = self.random()
+                    if turn > key:
+                        heapq.heappush(heap, (turn, j))
+            if self.profiler:
+                self.profiler.lap('frontier')
+
+    def frontier(self, crowd_thresh):
+        """ Nodes whose visit this tick could change the simulation."""
+        exposed = self.inf_nbs > 0 if crowd_thresh > 0 else True
+        return np.flatnonzero((self.state > 0)
+                            | ((self.state == SUSCEPTIBLE) & exposed)
+                            | ((self.isolated > 0) & (self.state != DEAD)))
+
+    def visit(self, i, conformity, crowd_thresh):
+        """ Update node i in place, returns whether it just got infected.
+
+        Reads single entries with item(), which skips building a NumPy
+        scalar, and looks infection probabilities up in infection_probs.
+        """
+        state, inf_nbs = self.state, self.inf_nbs
+        prof = self.profiler
+        s = state.item(i)
+
+        # IF INFECTED
+        if s > 0:
+
+            if self.random() < self.death_prob():
+                slots = self.g.slots(i)
+                inf_nbs[self.g.indices[slots]] -= 1
+                self.g.remove_slots(slots)
+                state[i] = DEAD
+                self.tombstones += 1
+                self.data['dead'] += 1
+                self.data['alive'] -= 1
+                self.data['infected'] -= 1
+                if prof:
+                    prof.count('deaths')
+                    prof.count('neighbor_scans', len(slots))
+                    prof.lap('death')
+
+            elif self.random() < s / 14:
+                nbs = self.g.neighbors(i)
+                inf_nbs[nbs] -= 1
+                state[i] = RECOVERED
+                self.data['recovered'] += 1
+                self.data['infected'] -= 1
+                if prof:
+                    prof.count('recoveries')
+                    prof.count('neighbor_scans', len(nbs))
+                    prof.lap('recovery')
+
+            else:
+                state[i] = s + 1
+                if prof:
+                    prof.lap('infected')
+
+        # IF RECOVERED
+        elif s == RECOVERED:
+            if self.isolated.item(i):
+                # Exit Isolation
+                if self.reconnect(i) is not None and prof:
+                    prof.count('reconnections')
+            if prof:
+                prof.lap('recovered')
+
+        # IF SUSCEPTIBLE
+        elif s == SUSCEPTIBLE:
+            num_inf_nbs = inf_nbs.item(i)
+            caught = self.random() < self.infection_probs[num_inf_nbs]
+
+            if caught:
+                # Node i gets infected
+                nbs = self.g.neighbors(i)
+                inf_nbs[nbs] += 1
+                state[i] = 1
+                self.data['infected'] += 1
+                self.data['susceptible'] -= 1
+                if prof:
+                    prof.count('infections')
+                    prof.count('neighbor_scans', len(nbs))
+            # Exit Isolation
+            if num_inf_nbs < crowd_thresh and self.isolated.item(i):
+                if self.reconnect(i) is not None and prof:
+                    prof.count('reconnections')
+            if prof:
+                prof.lap('infection')
+
+            # Enter Isolation
+            if num_inf_nbs >= crowd_thresh:
+                slots = self.g.slots(i)
+                cut = slots[self.rng.random(len(slots)) < conformity]
+                nbs = self.g.indices[cut]
+                inf_nbs[i] -= np.count_nonzero(state[nbs] > 0)
+                if caught:
+                    inf_nbs[nbs] -= 1
+                self.g.remove_slots(cut)
+                self.severed[cut] = True
+                self.isolated[i] += len(cut)
+                if prof:
+                    prof.count('isolation_edges', len(cut))
+                    prof.lap('isolation')
+
+            return caught
+
+        return False
+
+    def reconnect(self, i):
+        """ Restores one random edge node i cut while isolating.
+
+        Returns the restored slot, or None when the far end has died and
+        the edge was dropped.
+        """
+        start, stop = self.g.indptr[i], self.g.indptr[i + 1]
+        slots = start + np.flatnonzero(self.severed[start:stop])
+        slot = slots[int(self.random() * len(slots))]
+        self.severed[slot] = False
+        self.isolated[i] -= 1
+
+        j = self.g.indices[slot]
+        if self.state[j] == DEAD:
+            return None
+        self.g.restore_slots(slot)
+        if self.state[i] > 0:
+            self.inf_nbs[j] += 1
+        if self.state[j] > 0:
+            self.inf_nbs[i] += 1
+        return int(slot)
+
+    def reconnect_all(self, nodes):
+        """ reconnect for each of the given distinct nodes at once.
+
+        Returns the number of edges restored.
+        """
+        slots, owners = self.g.row_slots(nodes, return_owners=True,
+                                        mask=self.severed)
+        counts = self.isolated[nodes].astype(np.int64)
+        first = np.cumsum(counts) - counts
+        picks = slots[first + (self.rng.random(len(nodes))
+                            * counts).astype(np.int64)]
+        self.severed[picks] = False
+        self.isolated[nodes] -= 1
+
+        far = self.g.indices[picks]
+        alive = self.state[far] != DEAD
+        picks, nodes, far = picks[alive], nodes[alive], far[alive]
+        self.g.restore_slots(picks)
+        np.add.at(self.inf_nbs, far, self.state[nodes] > 0)
+        self.inf_nbs[nodes] += self.state[far] > 0
+        return len(picks)
+
+    def update_synchronous(self, conformity, crowd_thresh):
+        """ Apply one tick to every node at once from start-of-tick states."""
+        state, inf_nbs = self.state, self.inf_nbs
+
+        # IF INFECTED
+        infected = np.flatnonzero(state > 0)
+        dies = self.rng.random(len(infected)) < self.death_probs(infected)
+        recovers = ~dies & (self.rng.random(len(infected))
+                            < self.recov_prob(infected))
+
+        # IF SUSCEPTIBLE
+        susceptible = np.flatnonzero(state == SUSCEPTIBLE)
+        exposure = inf_nbs[susceptible]
+        catches = self.rng.random(len(susceptible)) \
+                    < self.infection_prob(exposure)
+        if self.profiler:
+            self.profiler.lap('draws')
+
+        # Enter Isolation, only susceptible nodes cut so only they lose
+        # infected neighbors here.
+        crowded = susceptible[exposure >= crowd_thresh]
+        slots, owners = self.g.row_slots(crowded, return_owners=True)
+        cut = self.rng.random(len(slots)) < conformity
+        slots, owners = slots[cut], crowded[owners[cut]]
+        # An edge cut from both ends belongs to the end with the lower slot.
+        twins = self.g.twin[slots]
+        mine = (slots < twins) | ~np.isin(twins, slots)
+        slots, owners = slots[mine], owners[mine]
+        np.subtract.at(inf_nbs, owners, state[self.g.indices[slots]] > 0)
+        self.g.remove_slots(slots)
+        self.severed[slots] = True
+        np.add.at(self.isolated, owners, 1)
+        if self.profiler:
+            self.profiler.count('isolation_edges', len(slots))
+            self.profiler.lap('isolation')
+
+        # Exit Isolation, for recovered nodes and uncrowded susceptible ones.
+        calm = np.concatenate((np.flatnonzero(state == RECOVERED),
+                            susceptible[exposure < crowd_thresh]))
+        restored = self.reconnect_all(calm[self.isolated[calm] > 0])
+        if self.profiler:
+            self.profiler.count('reconnections', restored)
+            self.profiler.lap('reconnection')
+
+        # Tell neighbors about nodes that started or stopped being infected.
+        changed = np.concatenate((susceptible[catches],
+                                infected[recovers | dies]))
+        delta = np.where(np.arange(len(changed)) < np.count_nonzero(catches),
+                        1, -1)
+        slots, owners = self.g.row_slots(changed, return_owners=True)
+        np.add.at(inf_nbs, self.g.indices[slots], delta[owners])
+        if self.profiler:
+            self.profiler.count('neighbor_scans', len(slots))
+            self.profiler.lap('neighbor_scan')
+
+        state[infected] += 1
+        state[infected[recovers]] = RECOVERED
+        state[infected[dies]] = DEAD
+        state[susceptible[catches]] = 1
+        self.g.remove_nodes(infected[dies])
+        self.tombstones += np.count_nonzero(dies)
+
+        self.tally(infected[dies], infected[recovers], susceptible[catches])
+        if self.profiler:
+            self.profiler.count('deaths', np.count_nonzero(dies))
+            self.profiler.count('recoveries', np.count_nonzero(recovers))
+            self.profiler.count('infections', np.count_nonzero(catches))
+            self.profiler.lap('transitions')
+
+    def death_probs(self, infected):
+        """ Death probability of each of the given infected nodes."""
+        return self.death_prob()
+
+    def tally(self, dead, recovered, caught):
+        """ Adds the transitions of a synchronous tick to data."""
+        self.data['dead'] += len(dead)
+        self.data['alive'] -= len(dead)
+        self.data['recovered'] += len(recovered)
+        self.data['infected'] += len(caught) - len(dead) - len(recovered)
+        self.data['susceptible'] -= len(caught)
+
+    def recov_prob(self, idx):
+        """ Recovery probability increases the longer a node is infected."""
+        return self.state[idx] / 14
+
+
+
+class LeanEpidemic(CSREpidemic):
+
+
+    """
+    CSREpidemic stored in the smallest array types, for millions of nodes.
+
+    Edge slots are indexed with int32 and the neighbor counters use uint16
+    whenever the largest degree fits, which holds for Barabasi-Albert graphs
+    far beyond 10^6 nodes. A Barabasi-Albert graph with m=2 has 4 edge slots
+    per node, giving this budget in bytes per node:
+
+        indices, twin   int32 x 4 slots x 2     32   (CSREpidemic: 64)
+        active, severed bool x 4 slots x 2       8   (8)
+        indptr          int32                    4   (8)
+        state           int8                     1   (1)
+        inf_nbs, isolated  uint16 x 2            4   (8)
+        total                                   49   (89)
+
+    Ticks add temporary arrays on top. The synchronous and frontier modes
+    allocate a few bytes per node per tick, while the sequential mode loops
+    over every node in Python and is impractical at this scale. Building the
+    graph takes several times the steady state while the slots are sorted.
+    """
+
+
+    INDEX_DTYPE = np.int32
+    COUNT_DTYPES = (np.uint16, np.int32)
@@ -0,0 +1,267 @@
+"""
+Continuous-time, event-driven alternative to the discrete daily sweep.
+"""
+
+import heapq
+import itertools
+import numpy as np
+import epidemic
+from epidemic import SUSCEPTIBLE, RECOVERED, DEAD
+
+
+def recovery_day_cdf(days=14):
+    """ CDF of the day an infection ends when recov_prob is d / days."""
+    hazard = np.arange(1, days + 1) / days
+    survive = np.concatenate(([1], np.cumprod(1 - hazard)[:-1]))
+    return np.cumsum(hazard * survive)
+
+
+class GillespieEpidemic(epidemic.CSREpidemic):
+
+
+    """
+    Continuous-time epidemic driven by a priority queue of pending events.
+
+    Rates are chosen so that a day of the event-driven process has the same
+    transition probabilities as a tick of the discrete model:
+        infection: every edge to an infected neighbor transmits at rate
+            -ln(1 - p_infect), so k infected neighbors infect a node within
+            a day with probability infection_prob(k).
+        recovery: the day of recovery is drawn at infection from the hazard
+            used by recov_prob, d / 14 on the d-th day, and placed uniformly
+            within that day. As in the discrete model, the first day is the
+            current one for the initial infections and the next one for a
+            node infected during a day.
+        death: from that same first day on, an infected node dies at rate
+            -ln(1 - death_prob()), which grows while infections exceed
+            capacity. Deaths are sampled by thinning against the largest
+            rate, so crossing capacity needs no rescheduling.
+        isolation: a susceptible node with at least crowd_thresh infected
+            neighbors cuts each edge with probability conformity once on
+            every day it stays crowded, at a random moment of that day.
+        reconnection: a node that cut edges checks again every day after,
+            and restores one of them on each check where it is recovered or
+            a susceptible below crowd_thresh.
+
+    update() moves the clock forward one day and handles every event due in
+    it, so tseries, stop_early and Simulations work as for the other
+    backends, while the cost of a day follows the number of events in it
+    instead of the number of nodes.
+
+    Matching each transition within a day does not make whole runs match,
+    because events within a day interleave differently than in a sweep.
+    Deaths and recoveries typically differ from the sequential sweep by
+    5-15%. At 300 nodes, p_infect 0.2 and p_die 0.01 over 50 days:
+        conformity 0.6, crowd 2: 11.6 +- 0.3 deaths against 10.3 +- 0.3
+        conformity 0, no isolation: 25.4 +- 0.5 against 27.7 +- 0.5
+    Use it for scaling and relative comparisons, not as a drop-in for the
+    discrete backends' numbers.
+
+    Attributes:
+        time [float]: current simulation time in days.
+        events [list]: heap of pending (time, seq, kind, node, source, slot).
+        watching [ndarray]: crowded susceptible nodes with a pending
+            isolation event.
+        rejoining [ndarray]: nodes with cut edges and a pending reconnect
+            event.
+        transmitting [ndarray]: slots with a pending infect event. An edge
+            restored while its event is still pending keeps that event,
+            whose remaining delay is again exponential.
+    """
+
+
+    MODES = ('continuous',)
+    RECOVERY_CDF = recovery_day_cdf()
+
+    def set_patient0(self, init_infect):
+        """ Set initial infected population and schedule their events."""
+        accum = super().set_patient0(init_infect)
+        self.time = 0.0
+        self.events = []
+        self.seq = itertools.count()
+        self.watching = None
+        self.rejoining = np.zeros(len(self.state), dtype=bool)
+        self.transmitting = np.zeros(len(self.g.indices), dtype=bool)
+        self.infect_rate = -np.log1p(-min(self.p_infect, 1.0))
+        self.max_death_rate = -np.log1p(-min(4*self.p_die, 1 - 1e-12))
+
+        for i in np.flatnonzero(self.state > 0).tolist():
+            self.schedule_infected(i, self.time)
+
+        return accum
+
+    def update_continuous(self, conformity, crowd_thresh):
+        """ Handle every event due before the end of the current day."""
+        self.conformity = conformity
+        self.crowd_thresh = crowd_thresh
+        if self.watching is None:
+            self.watching = np.zeros(len(self.state), dtype=bool)
+            crowded = (self.state == SUSCEPTIBLE) \
+                        & (self.inf_nbs >= crowd_thresh)
+            for i in np.flatnonzero(crowded).tolist():
+                self.watch(i)
+
+        end = self.tick + 1
+        while self.events and self.events[0][0] < end:
+            self.time, seq, kind, i, source, slot = \
+                heapq.heappop(self.events)
+            getattr(self, 'on_' + kind)(i, source, slot)
+            if self.profiler:
+                self.profiler.count('events')
+                self.profiler.lap(kind)
+
+        self.time = float(end)
+
+    def remap(self, keep, new):
+        """ Also moves pending transmissions over to the compacted slots.
+
+        Transmissions over a dropped slot involve a dead node and could
+        never fire, so they are discarded.
+        """
+        super().remap(keep, new)
+        self.transmitting = self.transmitting[keep]
+        self.events = [(time, seq, kind, i, source,
+                        slot if slot < 0 else int(new[slot]))
+                    for time, seq, kind, i, source, slot in self.events
+                    if slot < 0 or new[slot] >= 0]
+        heapq.heapify(self.events)
+
+    def push(self, time, kind, i, source=-1, slot=-1):
+        """ Add an event to the queue."""
+        heapq.heappush(self.events, (time, next(self.seq), kind, i, source,
+                        slot))
+
+    def schedule_infected(self, i, start):
+        """ Queue the recovery, death and transmissions of a new infection,
+        with recovery and death possible from the day starting at start."""
+        day = int(np.searchsorted(self.RECOVERY_CDF, self.random()))
+        self.push(start + day + self.random(), 'recover', i)
+        if self.max_death_rate > 0:
+            self.push(start + self.rng.exponential(1 / self.max_death_rate),
+                    'die', i)
+
+        if self.infect_rate > 0:
+            slots = self.g.slots(i)
+            slots = slots[self.state[self.g.indices[slots]] == SUSCEPTIBLE]
+            delays = self.rng.exponential(1 / self.infect_rate, len(slots))
+            self.transmitting[slots] = True
+            for slot, delay in zip(slots.tolist(), delays.tolist()):
+                self.push(self.time + delay, 'infect',
+                        int(self.g.indices[slot]), i, slot)
+
+    def watch(self, i):
+        """ Queue an isolation check for a newly crowded susceptible node."""
+        self.watching[i] = True
+        self.push(self.time + self.random(), 'isolate', i)
+
+    def on_infect(self, j, i, slot):
+        """ Node i transmits to node j if both and their edge are unchanged."""
+        self.transmitting[slot] = False
+        if self.state[j] != SUSCEPTIBLE or self.state[i] <= 0 \
+                or not self.g.active[slot]:
+            return
+
+        nbs = self.g.neighbors(j)
+        self.inf_nbs[nbs] += 1
+        self.state[j] = 1
+        self.data['infected'] += 1
+        self.data['susceptible'] -= 1
+        self.schedule_infected(j, float(self.tick + 1))
+        if self.profiler:
+            self.profiler.count('infections')
+
+        if self.watching is not None:
+            crowded = nbs[(self.state[nbs] == SUSCEPTIBLE)
+                        & (self.inf_nbs[nbs] >= self.crowd_thresh)
+                        & ~self.watching[nbs]]
+            for k in crowded.tolist():
+                self.watch(k)
+
+    def on_recover(self, i, source, slot):
+        """ Infected node i recovers."""
+        if self.state[i] <= 0:
+            return
+
+        self.inf_nbs[self.g.neighbors(i)] -= 1
+        self.state[i] = RECOVERED
+        self.data['recovered'] += 1
+        self.data['infected'] -= 1
+        if self.profiler:
+            self.profiler.count('recoveries')
+
+    def on_die(self, i, source, slot):
+        """ Candidate death of node i, accepted at the current death rate."""
+        if self.state[i] <= 0:
+            return
+
+        rate = -np.log1p(-min(self.death_prob(), 1 - 1e-12))
+        if self.random() * self.max_death_rate >= rate:
+            self.push(self.time + self.rng.exponential(1 / self.max_death_rate),
+                    'die', i)
+            return
+
+        slots = self.g.slots(i)
+        self.inf_nbs[self.g.indices[slots]] -= 1
+        self.g.remove_slots(slots)
+        self.state[i] = DEAD
+        self.tombstones += 1
+        self.data['dead'] += 1
+        self.data['alive'] -= 1
+        self.data['infected'] -= 1
+        if self.profiler:
+            self.profiler.count('deaths')
+
+    def on_isolate(self, i, source, slot):
+        """ Crowded susceptible node i cuts edges, then checks again in a
+        day."""
+        if self.state[i] != SUSCEPTIBLE \
+                or self.inf_nbs[i] < self.crowd_thresh:
+            self.watching[i] = False
+            return
+
+        slots = self.g.slots(i)
+        cut = slots[self.rng.random(len(slots)) < self.conformity]
+        self.inf_nbs[i] -= np.count_nonzero(
+                            self.state[self.g.indices[cut]] > 0)
+        self.g.remove_slots(cut)
+        self.severed[cut] = True
+        self.isolated[i] += len(cut)
+        if self.profiler:
+            self.profiler.count('isolation_edges', len(cut))
+        if len(cut) and not self.rejoining[i]:
+            self.rejoining[i] = True
+            self.push(self.time + 1, 'reconnect', i)
+
+        if self.inf_nbs[i] >= self.crowd_thresh:
+            self.push(self.time + 1, 'isolate', i)
+        else:
+            self.watching[i] = False
+
+    def on_reconnect(self, i, source, slot):
+        """ Node i restores a cut edge if calm, then checks again in a day."""
+        state = self.state
+        if state[i] == DEAD or not self.isolated[i]:
+            self.rejoining[i] = False
+            return
+
+        if state[i] == RECOVERED or (state[i] == SUSCEPTIBLE
+                                    and self.inf_nbs[i] < self.crowd_thresh):
+            slot = self.reconnect(i)
+            if slot is not None:
+                j = int(self.g.indices[slot])
+                if self.profiler:
+                    self.profiler.count('reconnections')
+                if state[i] == SUSCEPTIBLE and state[j] > 0:
+                    back = int(self.g.twin[slot])
+                    if self.infect_rate > 0 and not self.transmitting[back]:
+                        self.transmitting[back] = True
+                        self.push(self.time + self.rng.exponential(
+                                1 / self.infect_rate), 'infect', i, j, back)
+                    if self.inf_nbs[i] >= self.crowd_thresh \
+                            and not self.watching[i]:
+                        self.watch(i)
+
+        if self.isolated[i]:
+            self.push(self.time + 1, 'reconnect', i)
+        else:
+            self.rejoining[i] = False
@@ -0,0 +1,253 @@
+"""
+Array-backed graph structures used by the faster epidemic backends.
+"""
+
+import collections
+import functools
+import os
+import numpy as np
+
+
+class CSRGraph:
+
+
+    """
+    Compressed sparse row adjacency with an edge mask for cheap isolation.
+
+    Every undirected edge is stored twice, once in the row of each endpoint.
+    Removing an edge only clears its two slots in the mask, so isolation can
+    be undone later by setting them again without touching the structure.
+
+    Args:
+        size [int]: Number of nodes in the graph.
+        edges [ndarray]: (E, 2) array of undirected edges between node IDs.
+        dtype [dtype]: integer type of indptr, indices and twin. int32 halves
+            their size and holds graphs of up to 2**30 edges.
+
+    Attributes:
+        size [int]: Number of nodes in the graph.
+        indptr [ndarray]: offsets of each node's row in indices.
+        indices [ndarray]: neighbor at the far end of every edge slot.
+        twin [ndarray]: slot holding the reverse direction of every edge.
+        active [ndarray]: mask of the edge slots that are currently present.
+    """
+
+
+    def __init__(self, size, edges, dtype=np.int64):
+        """ Build both directions of every edge, sorted by source node."""
+        edges = np.asarray(edges, dtype=dtype).reshape(-1, 2)
+        num_edges = len(edges)
+        src = np.concatenate((edges[:, 0], edges[:, 1]))
+        dst = np.concatenate((edges[:, 1], edges[:, 0]))
+        order = np.lexsort((dst, src))
+
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(len(order))
+
+        self.size = size
+        self.indptr = np.zeros(size + 1, dtype=dtype)
+        np.cumsum(np.bincount(src, minlength=size), out=self.indptr[1:])
+        self.indices = dst[order]
+        del src, dst
+        order += num_edges
+        np.remainder(order, max(2 * num_edges, 1), out=order)
+        self.twin = inverse[order].astype(dtype)
+        self.active = np.ones(len(order), dtype=bool)
+
+    def copy(self):
+        """ Copy that shares the fixed structure and owns its edge mask."""
+        g = object.__new__(type(self))
+        g.__dict__.update(self.__dict__)
+        g.active = self.active.copy()
+        return g
+
+    @classmethod
+    def from_networkx(cls, g, dtype=np.int64):
+        """ Convert a networkx graph whose nodes are labelled 0..n-1."""
+        return cls(g.number_of_nodes(), edge_array(g), dtype)
+
+    def slots(self, i):
+        """ Slots of node i whose edges are currently present."""
+        start, stop = self.indptr[i], self.indptr[i + 1]
+        return start + np.flatnonzero(self.active[start:stop])
+
+    def neighbors(self, i):
+        """ Node IDs currently connected to node i."""
+        return self.indices[self.slots(i)]
+
+    def row_slots(self, nodes, return_owners=False, mask=None):
+        """ Present edge slots of all the given nodes, concatenated.
+
+        With return_owners, also returns the position in nodes of the node
+        owning each slot. mask selects other slots than the present ones.
+        """
+        starts = self.indptr[nodes]
+        lengths = self.indptr[nodes + 1] - starts
+        offsets = np.arange(lengths.sum()) \
+                    - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        slots = np.repeat(starts, lengths) + offsets
+        present = (self.active if mask is None else mask)[slots]
+        if return_owners:
+            owners = np.repeat(np.arange(len(nodes)), lengths)
+            return slots[present], owners[present]
+        return slots[present]
+
+    def matvec(self, values):
+        """ Sum values over each node's present neighbors (A @ values)."""
+        weights = np.where(self.active, values[self.indices], 0)
+        totals = np.zeros(len(weights) + 1, dtype=np.int64)
+        np.cumsum(weights, out=totals[1:])
+        return totals[self.indptr[1:]] - totals[self.indptr[:-1]]
+
+    def remove_slots(self, slots):
+        """ Remove the edges held in the given slots, in both directions."""
+        self.active[slots] = False
+        self.active[self.twin[slots]] = False
+
+    def restore_slots(self, slots):
+        """ Re-add edges previously removed with remove_slots."""
+        self.active[slots] = True
+        self.active[self.twin[slots]] = True
+
+    def remove_nodes(self, nodes):
+        """ Disconnect each of the given nodes from every neighbor."""
+        self.remove_slots(self.row_slots(nodes))
+
+    def compact(self, keep):
+        """ Drops every slot outside keep from the structure for good.
+
+        keep must hold both slots of an edge or neither. The arrays are
+        replaced rather than edited, so copies sharing them are unaffected.
+        Returns the new slot of every old one, -1 for dropped slots.
+        """
+        new = np.cumsum(keep) - 1
+        new[~keep] = -1
+        owners = np.repeat(np.arange(self.size, dtype=self.indptr.dtype),
+                        np.diff(self.indptr))
+        indptr = np.zeros_like(self.indptr)
+        np.cumsum(np.bincount(owners[keep], minlength=self.size),
+                out=indptr[1:])
+
+        self.indptr = indptr
+        self.indices = self.indices[keep]
+        self.twin = new[self.twin[keep]].astype(self.indices.dtype)
+        self.active = self.active[keep]
+        return new
+
+
+class GraphPool:
+
+
+    """
+    Pool of pre-generated Barabasi-Albert topologies stored as edge arrays.
+
+    Barabasi-Albert graphs of a given size and m always have the same number
+    of edges, so the pool is a single (count, edges, 2) int32 array that can
+    be saved to a .npy file and memory-mapped back by every worker process.
+    The CSR structures built by csr are cached for the MAX_TEMPLATES most
+    recently used graphs only, so a worker never holds the whole pool.
+
+    Args:
+        size [int]: Number of nodes of every graph.
+        count [int]: Number of graphs to generate.
+        m [int]: edges added with every new node.
+        seed [int]: seed the graph seeds are derived from.
+
+    Attributes:
+        size [int]: Number of nodes of every graph.
+        edges [ndarray]: (count, edges, 2) endpoints of every graph.
+    """
+
+
+    MAX_TEMPLATES = 8
+
+    def __init__(self, size, count, m=2, seed=None):
+        """ Generate count seeded graphs and keep only their edge arrays."""
+        seeds = np.random.SeedSequence(seed).spawn(count)
+        self.size = size
+        self.edges = np.stack([barabasi_albert_edges(size, m, ss)
+                            for ss in seeds])
+        self.templates = collections.OrderedDict()
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """ Open a pool saved with save, memory-mapped by default."""
+        pool = object.__new__(cls)
+        pool.edges = np.load(path, mmap_mode=mmap_mode)
+        pool.size = int(pool.edges[0].max()) + 1
+        pool.templates = collections.OrderedDict()
+        return pool
+
+    def save(self, path):
+        """ Write the edge arrays to a .npy file."""
+        np.save(path, self.edges)
+
+    def __len__(self):
+        return len(self.edges)
+
+    def __getitem__(self, k):
+        """ Edge array of graph k."""
+        return self.edges[k]
+
+    def csr(self, k, dtype=np.int64):
+        """ Fresh CSRGraph of graph k with dtype indices, sharing a cached
+        structure."""
+        key = k, np.dtype(dtype)
+        if key in self.templates:
+            self.templates.move_to_end(key)
+        else:
+            self.templates[key] = CSRGraph(self.size, self.edges[k], dtype)
+            if len(self.templates) > self.MAX_TEMPLATES:
+                self.templates.popitem(last=False)
+        return self.templates[key].copy()
+
+
+def barabasi_albert_edges(size, m=2, seed=None):
+    """ (E, 2) int32 edges of a Barabasi-Albert graph, without networkx.
+
+    Grows the graph as nx.barabasi_albert_graph does: a star on nodes
+    0..m, then every new node attaches to m distinct targets drawn from the
+    list of edge endpoints, so targets are picked in proportion to degree.
+    The graphs follow the same distribution but not the same draws, and the
+    edges go straight into arrays instead of a networkx Graph.
+    """
+    if m < 1 or m >= size:
+        raise ValueError("Barabasi-Albert network must have m >= 1 and "
+                        "m < size, m = %d, size = %d" % (m, size))
+
+    rng = np.random.default_rng(seed)
+    repeated = list(range(1, m + 1)) + [0] * m
+    targets = list(range(1, m + 1))
+    uniforms = []
+    for source in range(m + 1, size):
+        chosen = set()
+        while len(chosen) < m:
+            if not uniforms:
+                uniforms = rng.random(4096).tolist()
+            chosen.add(repeated[int(uniforms.pop() * len(repeated))])
+        targets.extend(chosen)
+        repeated.extend(chosen)
+        repeated.extend([source] * m)
+
+    edges = np.empty((len(targets), 2), dtype=np.int32)
+    edges[:m, 0] = 0
+    edges[m:, 0] = np.repeat(np.arange(m + 1, size, dtype=np.int32), m)
+    edges[:, 1] = targets
+    return edges
+
+
+def load_pool(path):
+    """ GraphPool.load, opened once per process for each version of the file."""
+    stat = os.stat(path)
+    return open_pool(path, stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=4)
+def open_pool(path, mtime, size):
+    """ GraphPool.load cached on the file's modification time and size."""
+    return GraphPool.load(path)
+
+
+def edge_array(g):
+    """ (E, 2) int32 array of the edges of a networkx graph."""
+    return np.array(list(g.edges), dtype=np.int32).reshape(-1, 2)
@@ -3,6 +3,8 @@ import simulations
 def main():
     N = 5000
     sims = 1000
-    S = simulations.Simulations(N, sims)
+    S = simulations.Simulations(N, sims, workers=None).run_all()
     S.export_data()
-main()
+
+if __name__ == '__main__':
+    main()
@@ -1,35 +1,42 @@
 import matplotlib.pyplot as plt
-from numpy import mean
-import json
+import aggregate
+import sweep
 
-def plot_data_death(data):
+def plot_data_death(summary, metric='dead'):
     """ Plot death histograms for each parameter combination in the sims."""
+    cells = {}
+    for key in summary.cells:
+        point = sweep.parse_key(key)
+        cells[point['conformity'], point['crowd']] = summary.cell(key, metric)
+    conformities = sorted({c for c, t in cells}, reverse=True)
+    crowds = sorted({t for c, t in cells})
+
     plt.style.use('ggplot')
-    gs = plt.GridSpec(5, 5)
+    gs = plt.GridSpec(len(conformities), len(crowds))
     plt.suptitle('Comparison of Different Social Distancing Parameters ', fontsize='x-large')
 
-    for i in range(5):
-        for j in range(5):
-            arr = []
+    for i, conformity in enumerate(conformities):
+        for j, crowd in enumerate(crowds):
+            if (conformity, crowd) not in cells:
+                continue
             plt.subplot(gs[i, j])
+            cell = cells[conformity, crowd]
 
-            for result in data[str(i) + ', ' + str(j)]:
-                arr.append(result['dead'])
-
-            m, bins, patches = plt.hist(arr, color='skyblue')
+            m, bins, patches = plt.hist(cell['edges'][:-1], cell['edges'],
+                                        weights=cell['hist'], color='skyblue')
             plt.hlines(0, 0, 600, alpha=0)
-            plt.vlines(mean(arr), 0, max(m), color='red', linestyles='dashed')
-            if i == 4:
-                plt.xlabel("Crowd Threshold: " + str(j+1))
+            plt.vlines(cell['mean'], 0, max(m), color='red',
+                    linestyles='dashed')
+            if i == len(conformities) - 1:
+                plt.xlabel("Crowd Threshold: " + str(crowd))
             if j == 0:
-                plt.ylabel("Conformity:\n" + str(20*(5-i)) + '%')
+                plt.ylabel("Conformity:\n" + str(round(100*conformity)) + '%')
     plt.show()
 
 def main():
+    # Either a json/jsonl file or a directory written with columnar=True.
+    # The summary is cached next to it, see aggregate.summarize.
     file = 'simulation-data-5000-1000.json'
-    with open(file) as json_file:
-        data = json.load(json_file)
-
-    plot_data_death(data)
+    plot_data_death(aggregate.summarize(file))
 
 main()
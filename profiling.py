@@ -0,0 +1,85 @@
+"""
+Optional instrumentation of the time and events inside Epidemic.update.
+"""
+
+import time
+from collections import defaultdict
+
+
+class Profiler:
+
+
+    """
+    Accumulates per-phase timings and event counts of one simulation.
+
+    Instrumented code calls lap(phase) at the end of each phase, charging the
+    time since the previous lap to that phase, and count(event, n) whenever
+    something happens. end_tick closes the tick and keeps its event counts.
+    An Epidemic without a profiler skips all of this behind a single None
+    check per instrumentation point.
+
+    Attributes:
+        seconds [dict]: total time charged to each phase.
+        counts [dict]: total number of each event.
+        ticks [list]: event counts of every finished tick.
+    """
+
+
+    def __init__(self):
+        """ Start with empty totals."""
+        self.seconds = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.ticks = []
+        self.current = defaultdict(int)
+        self.last = time.perf_counter()
+
+    def start(self):
+        """ Reset the lap clock, so time before it is not charged."""
+        self.last = time.perf_counter()
+
+    def lap(self, phase):
+        """ Charge the time since the previous lap to phase."""
+        now = time.perf_counter()
+        self.seconds[phase] += now - self.last
+        self.last = now
+
+    def count(self, event, n=1):
+        """ Record n occurrences of event in the current tick."""
+        self.current[event] += int(n)
+
+    def end_tick(self):
+        """ Close the current tick and add its events to the totals."""
+        for event, n in self.current.items():
+            self.counts[event] += n
+        self.ticks.append(dict(self.current))
+        self.current.clear()
+
+    def report(self):
+        """ Plain dict of the totals and per-tick counts."""
+        return {'seconds': dict(self.seconds),
+                'counts': dict(self.counts),
+                'ticks': list(self.ticks)
+                }
+
+
+def merge(reports):
+    """ Sums the totals of several reports, per-tick counts tick by tick."""
+    merged = {'runs': 0, 'seconds': defaultdict(float),
+            'counts': defaultdict(int), 'ticks': []}
+
+    for report in reports:
+        merged['runs'] += 1
+        for phase, seconds in report['seconds'].items():
+            merged['seconds'][phase] += seconds
+        for event, n in report['counts'].items():
+            merged['counts'][event] += n
+        for t, counts in enumerate(report['ticks']):
+            if t == len(merged['ticks']):
+                merged['ticks'].append(defaultdict(int))
+            for event, n in counts.items():
+                merged['ticks'][t][event] += n
+
+    merged['seconds'] = dict(merged['seconds'])
+    merged['counts'] = dict(merged['counts'])
+    merged['ticks'] = [dict(counts) for counts in merged['ticks']]
+    return merged
@@ -0,0 +1,179 @@
+"""
+Readers and writers for simulation results stored on disk.
+"""
+
+import json
+import os
+import numpy as np
+
+
+class JSONLinesWriter:
+
+
+    """
+    Append-only sink that writes one finished replicate per line.
+
+    Each line is a JSON object with the grid cell key, replicate number,
+    master seed and final data of one simulation, plus its per-tick counters
+    when they were recorded. Lines are flushed as soon
+    as they are written, so a crash loses at most the replicate in flight.
+
+    Args:
+        path [str]: file to append records to, created if missing.
+
+    Attributes:
+        path [str]: file records are appended to.
+    """
+
+
+    def __init__(self, path):
+        """ Open path for appending, dropping a partially written last line."""
+        self.path = path
+        drop_partial_line(path)
+        self.f = open(path, 'a')
+
+    def write(self, cell, replicate, seed, data, tseries=None):
+        """ Append the record of one finished replicate."""
+        record = {'cell': cell,
+                'replicate': replicate,
+                'seed': seed,
+                'data': data
+                }
+        if tseries is not None:
+            record['tseries'] = tseries.tolist()
+        self.f.write(json.dumps(record) + '\n')
+        self.f.flush()
+
+    def close(self):
+        """ Close the underlying file."""
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def drop_partial_line(path):
+    """ Truncate an unterminated final line left behind by a crash."""
+    if not os.path.exists(path):
+        return
+
+    with open(path, 'rb+') as f:
+        content = f.read()
+        if content and not content.endswith(b'\n'):
+            f.truncate(content.rfind(b'\n') + 1)
+
+
+def read_records(path):
+    """ Yields every complete record stored in a JSON Lines result file."""
+    if not os.path.exists(path):
+        return
+
+    with open(path) as f:
+        for line in f:
+            if line.endswith('\n'):
+                yield json.loads(line)
+
+
+def load_jsonl(path):
+    """ Rebuilds the all_data layout of Simulations from a result file."""
+    cells = {}
+    seed = None
+    for record in read_records(path):
+        if seed is None:
+            seed = record['seed']
+        elif record['seed'] != seed:
+            raise ValueError("%s mixes runs of master seeds %d and %d"
+                            % (path, seed, record['seed']))
+        cells.setdefault(record['cell'], {})[record['replicate']] = \
+            record['data']
+
+    return {key: [runs[k] for k in sorted(runs)] for key, runs in cells.items()}
+
+
+class ColumnarResults:
+
+
+    """
+    Memory-mapped view of results saved with save_columnar.
+
+    The directory holds one (cells, replicates) .npy array per metric, a
+    counts.npy array with the number of replicates stored for each cell, and
+    an index.json file naming the cells and metrics. Recorded trajectories
+    are kept in tseries.npy with shape (cells, replicates, ticks, 5). Arrays
+    are opened with numpy's mmap_mode, so slicing a cell only reads the rows
+    it needs.
+
+    Args:
+        path [str]: directory written by save_columnar.
+        mmap_mode [str]: mode passed to numpy.load, None loads into memory.
+
+    Attributes:
+        cells [list]: cell keys in row order.
+        metrics [list]: names of the stored metrics.
+        counts [ndarray]: number of valid replicates in each row.
+    """
+
+
+    def __init__(self, path, mmap_mode='r'):
+        """ Read the index and open the counts array."""
+        self.path = path
+        self.mmap_mode = mmap_mode
+        with open(os.path.join(path, 'index.json')) as f:
+            index = json.load(f)
+
+        self.cells = index['cells']
+        self.metrics = index['metrics']
+        self.rows = {key: row for row, key in enumerate(self.cells)}
+        self.counts = np.load(os.path.join(path, 'counts.npy'))
+        self.arrays = {}
+
+    def __getitem__(self, metric):
+        """ The full (cells, replicates) array of a metric."""
+        if metric not in self.arrays:
+            self.arrays[metric] = np.load(os.path.join(self.path,
+                                metric + '.npy'), mmap_mode=self.mmap_mode)
+        return self.arrays[metric]
+
+    def cell(self, key, metric):
+        """ Values of a metric for every replicate of one cell."""
+        row = self.rows[key]
+        return self[metric][row, :self.counts[row]]
+
+    def trajectories(self, key):
+        """ Per-tick counters of every replicate of one cell."""
+        row = self.rows[key]
+        return self['tseries'][row, :self.counts[row]]
+
+
+def save_columnar(path, all_data, trajectories=None):
+    """ Writes the all_data layout as one .npy array per metric under path."""
+    os.makedirs(path, exist_ok=True)
+    cells = list(all_data)
+    metrics = list(next(runs[0] for runs in all_data.values() if runs))
+    counts = np.array([len(all_data[key]) for key in cells], dtype=np.int64)
+
+    for metric in metrics:
+        column = np.lib.format.open_memmap(os.path.join(path, metric + '.npy'),
+                                mode='w+', dtype=np.int64,
+                                shape=(len(cells), int(counts.max())))
+        for row, key in enumerate(cells):
+            column[row, :counts[row]] = [data[metric] for data in all_data[key]]
+        column.flush()
+        del column
+
+    if trajectories:
+        shape = next(iter(trajectories.values())).shape[1:]
+        column = np.lib.format.open_memmap(os.path.join(path, 'tseries.npy'),
+                                mode='w+', dtype=np.int32,
+                                shape=(len(cells), int(counts.max())) + shape)
+        for row, key in enumerate(cells):
+            column[row, :counts[row]] = trajectories[key][:counts[row]]
+        column.flush()
+        del column
+
+    np.save(os.path.join(path, 'counts.npy'), counts)
+    with open(os.path.join(path, 'index.json'), 'w') as f:
+        json.dump({'cells': cells, 'metrics': metrics}, f)
@@ -1,5 +1,147 @@
+import batched
+import cache as caches
 import epidemic
+import gillespie
+import graph
+import profiling
+import results
+import stats
+import sweep as sweeps
+import workqueue
+import hashlib
 import json
+import os
+import sys
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+BACKENDS = {'networkx': epidemic.Epidemic,
+            'csr': epidemic.CSREpidemic,
+            'lean': epidemic.LeanEpidemic,
+            'gillespie': gillespie.GillespieEpidemic,
+            'batched': batched.BatchedEpidemic
+            }
+
+
+def run_task(task):
+    """ Runs the replicates described by task.
+
+    Returns the (data, tseries) pair of every replicate and the profiler
+    report of the task, which is None unless profiling was requested.
+    """
+    model = BACKENDS[task['backend']]
+    record_steps = task['len_of_sims'] if task['record'] else 0
+    batch = issubclass(model, batched.BatchedEpidemic)
+
+    topology = task['topology']
+    if topology is not None:
+        pool = graph.load_pool(topology[0][0])
+        if batch:
+            topology = [pool[k] for path, k in topology]
+        elif issubclass(model, epidemic.CSREpidemic):
+            topology = pool.csr(topology[0][1], model.INDEX_DTYPE)
+        else:
+            topology = pool[topology[0][1]]
+
+    if batch:
+        E = model(len(task['replicates']), task['size'], task['p_infect'],
+                task['p_die'], task['init_infect'], mode=task['mode'],
+                seed=task['seed'], record_steps=record_steps,
+                topology=topology, profile=task['profile'])
+    else:
+        E = model(task['size'], task['p_infect'], task['p_die'],
+                task['init_infect'], mode=task['mode'], seed=task['seed'],
+                record_steps=record_steps, topology=topology,
+                profile=task['profile'])
+    E.run(task['len_of_sims'], task['conformity'], task['crowd'],
+        task['stop_early'])
+
+    report = E.profiler.report() if E.profiler else None
+    if not batch:
+        return [(E.data, E.tseries)], report
+    if E.tseries is None:
+        return [(data, None) for data in E.data], report
+    return list(zip(E.data, E.tseries)), report
+
+
+def run_chunk(tasks):
+    """ Runs several tasks in one call, see run_task."""
+    return [run_task(task) for task in tasks]
+
+
+def share(requests, left):
+    """ Splits left between requests in proportion to their sizes.
+
+    Every request gets the integer part of its share, and what that leaves
+    goes one each to the largest fractional parts, so equal requests differ
+    by at most one.
+    """
+    total = sum(requests.values())
+    if total <= left:
+        return dict(requests)
+    left = max(left, 0)
+    shares = {key: n * left // total for key, n in requests.items()}
+    rest = left - sum(shares.values())
+    for key in sorted(requests, key=lambda key: requests[key] * left % total,
+                    reverse=True)[:rest]:
+        shares[key] += 1
+    return {key: n for key, n in shares.items() if n}
+
+
+class Progress:
+
+
+    """
+    Throttled report of how many replicates of a sweep have finished.
+
+    Args:
+        interval [float]: least number of seconds between two reports.
+        stream [file]: where reports are written, stdout when None.
+
+    Attributes:
+        total [int]: replicates planned so far.
+        done [int]: replicates finished so far.
+    """
+
+
+    def __init__(self, interval=1.0, stream=None):
+        """ Start the clock with nothing planned."""
+        self.interval = interval
+        self.stream = stream
+        self.total = 0
+        self.done = 0
+        self.start = time.perf_counter()
+        self.shown = self.start
+
+    def add(self, n):
+        """ Plans n more replicates."""
+        self.total += n
+
+    def update(self, n=1):
+        """ Marks n replicates finished, reporting if interval has passed."""
+        self.done += n
+        now = time.perf_counter()
+        if now - self.shown >= self.interval:
+            self.show(now)
+
+    def show(self, now):
+        """ Writes the current count, rate and estimated time left."""
+        self.shown = now
+        stream = self.stream or sys.stdout
+        rate = self.done / max(now - self.start, 1e-9)
+        left = (self.total - self.done) / rate if rate else float('inf')
+        end = '\r' if stream.isatty() else '\n'
+        stream.write("%d/%d replicates (%.0f%%), %.1f/s, %.0fs left%s"
+                    % (self.done, self.total,
+                    100 * self.done / max(self.total, 1), rate, left, end))
+        stream.flush()
+
+    def close(self):
+        """ Writes the final count."""
+        self.show(time.perf_counter())
+        (self.stream or sys.stdout).write("\nCOMPLETE\n")
+
 
 class Simulations:
 
@@ -7,55 +149,397 @@ class Simulations:
     """
     Controller for running many epidemic simulations and saving data.
 
+    The cells scanned are the points of a sweep.Sweep, keyed by their
+    parameter values, by default the 5x5 grid of conformity and crowd
+    threshold. Every (cell, replicate) pair is an independent task with its
+    own seed, derived from the master seed and the parameter values of its
+    point, so results do not depend on how tasks are spread over worker
+    processes or on which other points are in the sweep.
+    The batched backend instead runs up to batch_size replicates of a cell
+    per task, seeded from the first replicate of the batch.
+
+    Creating a Simulations only stores its settings; iterate over run() to
+    stream replicates as they finish, or call run_all().
+
     Args:
-        size [int]: Number of nodes for each simulation.
+        size [int]: Number of nodes for each simulation whose sweep point
+            does not set one.
         num_of_sims [int]: Number of simulations for a given set of parameters.
         len_of_sims [int]: Number of time steps until the simulation ends.
+        backend [str]: Epidemic implementation, a key of BACKENDS. All but
+            'gillespie' agree in distribution; see
+            gillespie.GillespieEpidemic for how far it departs from them.
+        mode [str]: update mode, see epidemic.Epidemic. None picks the
+            default mode of the backend.
+        workers [int]: Number of worker processes, None uses every core and 1
+            runs everything in this process.
+        chunksize [int]: Number of tasks handed to a worker at a time.
+        seed [int]: master seed for all simulations, random when None.
+        output [str]: JSON Lines file each replicate is appended to as soon
+            as it finishes.
+        resume [bool]: skip replicates already recorded in output. The master
+            seed is taken from the file when seed is None, and must match
+            it otherwise. Without resume, output must not hold results.
+        keep_data [bool]: whether to also hold every replicate in all_data.
+        record [bool]: whether to keep the per-tick counters of every run.
+        stop_early [bool]: end each run once no node is infected, see
+            epidemic.Epidemic.run.
+        graph_pool [str]: .npy file saved by graph.GraphPool to take the
+            networks from instead of generating one per run.
+        shared_topology [bool]: give replicate k the same pooled network in
+            every cell, so cells differ only in their parameters.
+        batch_size [int]: replicates per task for the batched backend, None
+            runs a whole cell at once.
+        profile [bool]: collect phase timings and event counts of every run,
+            see profile_report.
+        target_ci [float]: run cells sequentially until the confidence
+            interval of every metric in ci_metrics is at most this half-width
+            (in nodes). num_of_sims, at least 2, is then the number every
+            cell starts with. None runs exactly num_of_sims per cell.
+        max_sims [int]: most replicates a cell may reach, 10 * num_of_sims
+            when None.
+        budget [int]: most replicates over all cells, unlimited when None.
+            When it cannot cover num_of_sims per cell, the first round is
+            shared out evenly too.
+        confidence [float]: confidence level of the intervals.
+        quantiles [tuple]: quantiles whose intervals must also reach
+            target_ci, besides the means.
+        ci_metrics [tuple]: data keys the intervals are computed for.
+        sweep [Sweep]: parameter points to run, see sweep.Sweep. Points
+            that share a key share a cell.
+        cache [str]: directory or cache.ResultCache of finished tasks to
+            reuse instead of running them again.
+        progress [bool]: report progress on stdout at most once a second,
+            or a Progress to report to instead.
+        queue [str]: SQLite file or workqueue.WorkQueue to hand the tasks to
+            instead of a process pool, so workers started elsewhere with
+            `python -m workqueue QUEUE` share the sweep. This process works
+            on the queue too unless workers is 0.
 
     Attributes:
         all_data [dict]: a dictionary to store all simulation data.
+        trajectories [dict]: (replicates, len_of_sims, 5) counters per tick
+            for each cell, with columns ordered as epidemic.METRICS.
+        profiles [dict]: profiler reports of the runs of each cell.
         size [int]: Number of simulations for a given set of parameters.
         sims [int]: Number of time steps until the simulation ends.
+        seed [int]: master seed the per-task seeds were derived from.
+        cache [ResultCache]: cache of finished tasks, or None.
+        queue [WorkQueue]: queue the tasks are run from, or None.
+
+    The other arguments are kept as attributes of the same name.
     """
 
 
-    def __init__(self, size, num_of_sims, len_of_sims=50):
-        """ Runs simluations while scanning through the two main parameters."""
+    def __init__(self, size, num_of_sims, len_of_sims=50, backend='networkx',
+                mode=None, workers=1, chunksize=None, seed=None,
+                output=None, resume=False, keep_data=True, record=False,
+                stop_early=False, graph_pool=None, shared_topology=False,
+                batch_size=None, profile=False, target_ci=None, max_sims=None,
+                budget=None, confidence=0.95, quantiles=(),
+                ci_metrics=('dead', 'recovered'), sweep=None,
+                cache=None, progress=True, queue=None):
+        """ Stores the sweep settings, see run for running the simulations."""
         self.all_data = {}
+        self.trajectories = {}
+        self.profiles = {}
         self.size = size
         self.sims = num_of_sims
+        self.len_of_sims = len_of_sims
+        self.backend = backend
+        self.mode = mode
+        self.workers = workers
+        self.chunksize = chunksize
+        self.output = output
+        self.keep_data = keep_data
+        self.record = record
+        self.stop_early = stop_early
+        self.graph_pool = graph_pool
+        self.shared_topology = shared_topology
+        self.batch_size = batch_size
+        self.profile = profile
+        self.target_ci = target_ci
+        self.max_sims = 10 * num_of_sims if max_sims is None else max_sims
+        self.budget = budget
+        self.confidence = confidence
+        self.quantiles = quantiles
+        self.ci_metrics = ci_metrics
+        self.sweep = sweeps.Sweep() if sweep is None else sweep
+        self.cache = caches.ResultCache(cache) if isinstance(cache, str) \
+                    else cache
+        self.progress = Progress() if progress is True else progress or None
+        self.queue = workqueue.WorkQueue(queue) if isinstance(queue, str) \
+                    else queue
+
+        self.done = {}
+        if output is not None:
+            for record in results.read_records(output):
+                if not resume:
+                    raise ValueError("%s already holds results, resume them "
+                                    "or pick another output" % output)
+                if seed is None:
+                    seed = record['seed']
+                if record['seed'] != seed:
+                    raise ValueError("%s holds results of master seed %d, "
+                                    "not %d" % (output, record['seed'], seed))
+                self.done[record['cell'], record['replicate']] = \
+                    record['data'], record.get('tseries')
+        self.seed = np.random.SeedSequence(seed).entropy
+
+    def run(self):
+        """ Runs the sweep, yielding each replicate as soon as it finishes.
+
+        Every replicate is a dictionary with its cell key, replicate number,
+        parameter values, data and tseries (None unless recording). Replicates
+        resumed from output come first. all_data and trajectories are filled
+        in once the generator is exhausted.
+        """
+        pool = graph.load_pool(self.graph_pool) if self.graph_pool else None
+        pool_size = len(pool) if pool is not None else 0
+        grid = {}
+        for point in self.sweep.points:
+            point = dict(point, size=point['size'] or self.size)
+            key = self.sweep.key(point)
+            if grid.get(key, point) != point:
+                raise ValueError("points %r and %r share the key %r"
+                                % (grid[key], point, key))
+            if pool is not None and pool.size != point['size']:
+                raise ValueError("graph_pool holds %d node graphs, but %r "
+                                "needs %d nodes" % (pool.size, key,
+                                                    point['size']))
+            grid[key] = point
+        adaptive = self.target_ci is not None
+        keep = self.keep_data or adaptive
+
+        cells = {key: {} for key in grid}
+        wanted = {key: range(self.sims) for key in grid}
+        if self.budget is not None:
+            wanted = {key: range(n) for key, n in share(dict.fromkeys(grid,
+                    self.sims), self.budget).items()}
+        writer = results.JSONLinesWriter(self.output) if self.output else None
+        try:
+            while wanted:
+                tasks = []
+                for key, ks in wanted.items():
+                    point = grid[key]
+                    ident = self.point_id(point)
+                    if self.progress:
+                        self.progress.add(len(ks))
+                    pending = []
+                    for k in ks:
+                        if (key, k) in self.done:
+                            data, tseries = self.done[key, k]
+                            if not self.record or tseries is not None:
+                                if keep:
+                                    cells[key][k] = data, tseries
+                                if self.progress:
+                                    self.progress.update()
+                                yield self.replicate(key, k, point, data,
+                                                    tseries)
+                                continue
+                        pending.append(k)
+
+                    for batch in self.batches(pending, self.backend,
+                                            self.batch_size):
+                        tasks.append({'cell': key,
+                                    'replicates': batch,
+                                    'size': point['size'],
+                                    'len_of_sims': self.len_of_sims,
+                                    'backend': self.backend,
+                                    'mode': self.mode,
+                                    'conformity': point['conformity'],
+                                    'crowd': point['crowd'],
+                                    'p_infect': point['p_infect'],
+                                    'p_die': point['p_die'],
+                                    'init_infect': point['init_infect'],
+                                    'record': self.record,
+                                    'stop_early': self.stop_early,
+                                    'profile': self.profile,
+                                    'topology': self.topology(self.graph_pool,
+                                        pool_size, self.shared_topology,
+                                        ident, batch),
+                                    'seed': self.task_seed(ident, batch[0])
+                                    })
+
+                for key, k, data, tseries in self.run_round(tasks, writer):
+                    if keep:
+                        cells[key][k] = data, tseries \
+                            if self.record and self.keep_data else None
+                    yield self.replicate(key, k, grid[key], data, tseries)
+
+                if not adaptive:
+                    break
+                wanted = {key: range(len(cells[key]), len(cells[key]) + extra)
+                        for key, extra in self.allocate(cells).items()}
+        finally:
+            if writer:
+                writer.close()
+            if self.progress:
+                self.progress.close()
+
+        if self.keep_data:
+            for key, runs in cells.items():
+                ks = sorted(runs)
+                self.all_data[key] = [runs[k][0] for k in ks]
+                if self.record:
+                    self.trajectories[key] = np.array([runs[k][1]
+                                for k in ks], dtype=np.int32).reshape(
+                                len(ks), self.len_of_sims,
+                                len(epidemic.METRICS))
+
+    def run_all(self):
+        """ Runs the whole sweep without streaming, returning self."""
+        for replicate in self.run():
+            pass
+        return self
 
-        for i in range(5):
-            conformity = 0.2 * (5 - i)
+    def replicate(self, key, k, point, data, tseries):
+        """ Result of one replicate as yielded by run."""
+        return {'cell': key,
+                'replicate': k,
+                'params': point,
+                'data': data,
+                'tseries': tseries
+                }
 
-            for j in range(5):
-                crowd = j + 1
-                simulations = []
-                self.print_info(conformity, crowd)
+    def profile_report(self):
+        """ Phase timings and event counts summed over the runs of each cell."""
+        return {key: profiling.merge(reports)
+                for key, reports in self.profiles.items()}
 
-                for k in range(num_of_sims):
-                    print("Simulation # " + str(k+1))
-                    E = epidemic.Epidemic(size)
+    def run_round(self, tasks, writer):
+        """ Executes tasks, yielding (cell, replicate, data, tseries) of
+        every run after writing it to output, in the order runs finish."""
+        for task, (runs, report) in self.completed(tasks):
+            key = task['cell']
+            if report is not None:
+                self.profiles.setdefault(key, []).append(report)
 
-                    for l in range(len_of_sims):
-                        E.update(conformity, crowd)
+            for k, (data, tseries) in zip(task['replicates'], runs):
+                if writer:
+                    writer.write(key, k, self.seed, data, tseries)
+                if self.progress:
+                    self.progress.update()
+                yield key, k, data, tseries
 
-                    simulations.append(E.data)
-                self.all_data[str(i) + ', ' + str(j)] = simulations
+    def allocate(self, cells):
+        """ Extra replicates for each cell whose intervals are still too wide.
 
-        print()
-        print("COMPLETE")
+        A cell asks for as many replicates as the sample variance of each
+        metric says its mean needs, or twice its current count when only a
+        quantile is still too wide. Requests are capped at doubling the cell
+        per round, so an early variance estimate cannot overshoot, and at
+        max_sims. When budget cannot cover every request it is shared in
+        proportion to them, which favours the high-variance cells.
+        """
+        needs = {}
+        for key, runs in cells.items():
+            n = len(runs)
+            need = n
+            for metric in self.ci_metrics:
+                values = [data[metric] for data, tseries in runs.values()]
+                if stats.mean_halfwidth(values, self.confidence) \
+                        > self.target_ci:
+                    need = max(need, stats.required_samples(values,
+                                        self.target_ci, self.confidence))
+                for q in self.quantiles:
+                    if stats.quantile_halfwidth(values, q, self.confidence) \
+                            > self.target_ci:
+                        need = max(need, 2 * n)
+            need = min(need, 2 * n, self.max_sims)
+            if need > n:
+                needs[key] = need - n
 
-    def print_info(self, conformity, crowd):
-        """ Prints information about the next set of simulations."""
-        print("==============================")
-        print("Conformity set to: " + str(round(conformity, 1)))
-        print("Crowd Threshold set to: " +str(crowd))
-        print("==============================")
-        print()
+        if self.budget is None:
+            return needs
+        return share(needs, self.budget - sum(len(runs)
+                                            for runs in cells.values()))
+
+    def batches(self, pending, backend, batch_size):
+        """ Splits the pending replicates of a cell into tasks."""
+        if not issubclass(BACKENDS[backend], batched.BatchedEpidemic):
+            return [[k] for k in pending]
+
+        batch_size = batch_size or max(len(pending), 1)
+        return [pending[n:n + batch_size]
+                for n in range(0, len(pending), batch_size)]
+
+    def topology(self, graph_pool, pool_size, shared, ident, ks):
+        """ (pool file, graph index) of each replicate in ks of a point."""
+        if not graph_pool:
+            return None
+
+        if shared:
+            return [(graph_pool, k % pool_size) for k in ks]
+        return [(graph_pool, (ident + k) % pool_size)
+                for k in ks]
+
+    def point_id(self, point):
+        """ Stable 64 bit number identifying the parameter values of a point,
+        whether they are given as Python or numpy numbers."""
+        text = ', '.join('%s=%r' % (name, sweeps.plain(point[name]))
+                        for name in sweeps.PARAMS)
+        return int.from_bytes(hashlib.sha256(text.encode()).digest()[:8],
+                            'little')
+
+    def task_seed(self, ident, k):
+        """ Independent seed stream for replicate k of the point ident."""
+        return np.random.SeedSequence(self.seed, spawn_key=(ident, k))
+
+    def completed(self, tasks):
+        """ Yields (task, outcome) pairs, cached tasks first, then the rest
+        in the order they finish as they are stored in the cache."""
+        todo = []
+        for task in tasks:
+            outcome = self.cache.get(task) if self.cache else None
+            if outcome is None:
+                todo.append(task)
+            else:
+                yield task, outcome
+
+        if self.queue:
+            finished = workqueue.process(self.queue, todo, run_task,
+                                        local=self.workers != 0)
+        else:
+            finished = self.execute(todo, self.workers, self.chunksize)
+        for task, outcome in finished:
+            if self.cache:
+                self.cache.put(task, outcome)
+            yield task, outcome
+
+    def execute(self, tasks, workers, chunksize):
+        """ Yields (task, outcome) pairs as soon as each chunk of tasks
+        finishes, using a process pool."""
+        if workers == 1:
+            for task in tasks:
+                yield task, run_task(task)
+            return
+
+        if chunksize is None:
+            chunksize = max(1, len(tasks) // (4 * (workers or os.cpu_count())))
+
+        with ProcessPoolExecutor(workers) as pool:
+            chunks = {pool.submit(run_chunk, tasks[n:n + chunksize]):
+                    tasks[n:n + chunksize]
+                    for n in range(0, len(tasks), chunksize)}
+            for future in as_completed(chunks):
+                yield from zip(chunks[future], future.result())
+
+    def export_data(self, columnar=False):
+        """ Saves all_data as a json file to be used for visualization.
+
+        With columnar set, writes a directory of memory-mappable .npy arrays
+        instead, see results.ColumnarResults.
+        """
+        if columnar:
+            results.save_columnar("simulation-data-%d-%d" % (self.size,
+                                self.sims), self.all_data, self.trajectories)
+            return
 
-    def export_data(self):
-        """ Saves all_data as a json file to be used for visualization."""
         f = open("simulation-data-%d-%d.json." % (self.size, self.sims), 'w')
         json.dump(self.all_data, f, indent=4)
         f.close()
+
+        if self.trajectories:
+            np.savez_compressed("simulation-tseries-%d-%d.npz" % (self.size,
+                                self.sims), **self.trajectories)
@@ -0,0 +1,52 @@
+"""
+Confidence intervals used to decide when a cell has enough replicates.
+"""
+
+import math
+import statistics
+import numpy as np
+
+
+def z_score(confidence):
+    """ Two-sided standard normal critical value for the given level."""
+    return statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+
+
+def mean_halfwidth(values, confidence=0.95):
+    """ Half-width of the normal approximation interval of the mean."""
+    values = np.asarray(values, dtype=float)
+    if len(values) < 2:
+        return math.inf
+    return z_score(confidence) * values.std(ddof=1) / math.sqrt(len(values))
+
+
+def quantile_halfwidth(values, q, confidence=0.95):
+    """ Half-width of the distribution-free interval of the q-quantile.
+
+    The interval runs between the order statistics whose ranks lie z
+    binomial standard deviations either side of n*q.
+    """
+    values = np.sort(np.asarray(values, dtype=float))
+    n = len(values)
+    if n < 2:
+        return math.inf
+
+    spread = z_score(confidence) * math.sqrt(n * q * (1 - q))
+    lo = math.floor(n * q - spread)
+    hi = math.ceil(n * q + spread)
+    if lo < 0 or hi > n - 1:
+        return math.inf
+    return (values[hi] - values[lo]) / 2
+
+
+def required_samples(values, target, confidence=0.95):
+    """ Replicates needed for the mean interval to shrink to target.
+
+    Uses the sample variance of the values seen so far, so the estimate is
+    only as good as that variance.
+    """
+    values = np.asarray(values, dtype=float)
+    if len(values) < 2:
+        return len(values) + 1
+    sd = values.std(ddof=1)
+    return math.ceil((z_score(confidence) * sd / target) ** 2)
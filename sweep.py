@@ -0,0 +1,169 @@
+"""
+Parameter sweeps: the points of parameter space a Simulations run covers.
+"""
+
+import ast
+import itertools
+import math
+import re
+import numpy as np
+
+PARAMS = ('conformity', 'crowd', 'p_infect', 'p_die', 'init_infect', 'size')
+INTEGER_PARAMS = ('crowd', 'size')
+
+
+class Span:
+
+
+    """
+    Continuous range a parameter is sampled from.
+
+    Args:
+        low [float]: smallest value.
+        high [float]: largest value.
+        integer [bool]: draw whole numbers from low to high, each equally
+            likely.
+    """
+
+
+    def __init__(self, low, high, integer=False):
+        """ Store the bounds of the range."""
+        self.low = low
+        self.high = high
+        self.integer = integer
+
+    def __repr__(self):
+        return 'Span(%r, %r)' % (self.low, self.high)
+
+    def value(self, u):
+        """ Value at fraction u of the way from low to high."""
+        if self.integer:
+            steps = math.floor(u * (self.high - self.low + 1))
+            return int(min(self.low + steps, self.high))
+        return float(self.low + u * (self.high - self.low))
+
+
+class Sweep:
+
+
+    """
+    Set of parameter points to run replicates at.
+
+    Every parameter is a single value, a sequence of values, or a Span. The
+    'grid' sampling takes every combination of the sequences, in order.
+    'latin' and 'random' draw samples points instead, which scales to many
+    parameters and fine ranges: 'latin' splits each parameter into samples
+    equally likely strata and uses every stratum exactly once, 'random'
+    draws each coordinate independently. Sequences are sampled by position
+    and Spans uniformly over their range. Spans of crowd and size always
+    draw whole numbers.
+
+    The key of a point names every parameter at full precision, so it
+    stays the same when other parameters start to vary, and points only
+    share a key, and a cell, when all their values are equal.
+
+    Args:
+        conformity [float]: probability an infected node isolates itself.
+        crowd [int]: neighbor count above which a node isolates.
+        p_infect [float]: probability of infection per infected neighbor.
+        p_die [float]: base probability of death per day.
+        init_infect [float]: fraction of nodes infected at the start.
+        size [int]: Number of nodes, None to use the size of the Simulations.
+        sampling [str]: 'grid', 'latin' or 'random'.
+        samples [int]: Number of points drawn by 'latin' and 'random'.
+        seed [int]: seed for the sampled points.
+
+    Attributes:
+        points [list]: dictionary of parameter values for every point.
+        varying [list]: parameters that differ between points.
+    """
+
+
+    SAMPLINGS = ('grid', 'latin', 'random')
+
+    def __init__(self, conformity=(1.0, 0.8, 0.6, 0.4, 0.2),
+                crowd=(1, 2, 3, 4, 5), p_infect=0.2, p_die=0.01,
+                init_infect=0.01, size=None, sampling='grid', samples=None,
+                seed=None):
+        """ Expand the parameter specification into points."""
+        if sampling not in self.SAMPLINGS:
+            raise ValueError("sampling must be one of %s, got %r"
+                            % (self.SAMPLINGS, sampling))
+
+        spec = {'conformity': conformity, 'crowd': crowd,
+                'p_infect': p_infect, 'p_die': p_die,
+                'init_infect': init_infect, 'size': size}
+        for name, values in spec.items():
+            if isinstance(values, Span):
+                if name in INTEGER_PARAMS and not values.integer:
+                    spec[name] = Span(values.low, values.high, integer=True)
+            elif np.ndim(values) == 0:
+                spec[name] = [values]
+
+        if sampling == 'grid':
+            for name, values in spec.items():
+                if isinstance(values, Span):
+                    raise ValueError("%s is a Span, which needs 'latin' or "
+                                    "'random' sampling" % name)
+            self.points = [dict(zip(PARAMS, map(plain, values)))
+                        for values in itertools.product(*(spec[name]
+                                                        for name in PARAMS))]
+        else:
+            if not samples:
+                raise ValueError("%r sampling needs a number of samples"
+                                % sampling)
+            rng = np.random.default_rng(seed)
+            self.points = [{} for n in range(samples)]
+            for name in PARAMS:
+                if sampling == 'latin':
+                    u = (rng.permutation(samples) + rng.random(samples)) \
+                        / samples
+                else:
+                    u = rng.random(samples)
+                for point, x in zip(self.points, u):
+                    point[name] = draw(spec[name], x)
+
+        self.varying = [name for name in PARAMS
+                        if len({p[name] for p in self.points}) > 1]
+
+    def __len__(self):
+        return len(self.points)
+
+    def key(self, point):
+        """ Cell key naming every parameter value of a point."""
+        return ', '.join('%s=%r' % (name, plain(point[name]))
+                        for name in PARAMS)
+
+
+def draw(values, u):
+    """ Value of a Span or sequence at fraction u of its range."""
+    if isinstance(values, Span):
+        return values.value(u)
+    return plain(values[min(int(u * len(values)), len(values) - 1)])
+
+
+def plain(value):
+    """ Python number of a numpy scalar, other values unchanged."""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def parse_key(key):
+    """ Parameter values named in a cell key.
+
+    Also accepts keys of older results that name only some parameters,
+    and their 'i, j' keys, where conformity was 0.2 * (5 - i) and the crowd
+    threshold j + 1.
+    """
+    legacy = re.fullmatch(r'\s*(\d+),\s*(\d+)\s*', key)
+    if legacy:
+        i, j = map(int, legacy.groups())
+        return {'conformity': round(0.2 * (5 - i), 1), 'crowd': j + 1}
+
+    point = {}
+    for part in key.split(','):
+        name, _, value = part.strip().partition('=')
+        value = ast.literal_eval(value)
+        if value is not None:
+            value = int(value) if name in INTEGER_PARAMS else float(value)
+        point[name] = value
+    return point
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+import batched
+import epidemic
+import gillespie
+
+MODELS = [(epidemic.CSREpidemic, 'sequential'),
+        (epidemic.CSREpidemic, 'synchronous'),
+        (epidemic.CSREpidemic, 'frontier'),
+        (epidemic.LeanEpidemic, 'synchronous'),
+        (epidemic.LeanEpidemic, 'frontier'),
+        (gillespie.GillespieEpidemic, 'continuous')]
+
+
+def check_counters(E):
+    """ Incremental counters agree with a recount from the graph."""
+    alive = E.state != epidemic.DEAD
+    recount = E.g.matvec(E.state > 0)
+    assert (E.inf_nbs[alive] == recount[alive]).all()
+
+    cut = np.bincount(np.repeat(np.arange(E.g.size), np.diff(E.g.indptr)),
+                    weights=E.severed, minlength=E.g.size)
+    assert (E.isolated == cut).all()
+    assert not (E.severed & E.g.active).any()
+
+
+@pytest.mark.parametrize('model, mode', MODELS)
+def test_counters_match_recount(model, mode):
+    for seed in range(3):
+        E = model(600, init_infect=0.05, mode=mode, seed=seed)
+        for tick in range(40):
+            E.update(0.5, 2)
+            check_counters(E)
+            assert E.data['infected'] == np.count_nonzero(E.state > 0)
+
+
+def test_batched_counters_match_recount():
+    E = batched.BatchedEpidemic(4, 400, init_infect=0.05, seed=1)
+    for tick in range(40):
+        E.update(0.5, 2)
+        check_counters(E)
+        assert sum(data['infected'] for data in E.data) \
+            == np.count_nonzero(E.state > 0)
+
+
+def final_counts(mode, seeds):
+    """ Dead and recovered at the end of a run for every seed."""
+    finals = []
+    for seed in seeds:
+        E = epidemic.CSREpidemic(300, init_infect=0.02, mode=mode, seed=seed)
+        E.run(40, 0.6, 2)
+        finals.append([E.data['dead'], E.data['recovered']])
+    return np.array(finals)
+
+
+def test_frontier_matches_sequential():
+    """ Frontier and full sweeps draw from the same final distribution.
+
+    The seeds are fixed, and 3 standard errors is tight enough to tell the
+    synchronous mode apart from the sequential sweep.
+    """
+    a = final_counts('sequential', range(200))
+    b = final_counts('frontier', range(1000, 1200))
+    se = np.sqrt(a.var(axis=0, ddof=1) / len(a) + b.var(axis=0, ddof=1)
+                / len(b))
+    assert (abs(a.mean(axis=0) - b.mean(axis=0)) < 3 * se).all()
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+import bench
+import epidemic
+
+
+def test_lean_matches_csr():
+    """ The narrower dtypes leave every run unchanged."""
+    for mode in ('synchronous', 'frontier'):
+        lean = epidemic.LeanEpidemic(500, mode=mode, seed=3)
+        full = epidemic.CSREpidemic(500, mode=mode, seed=3)
+        lean.run(30, 0.6, 2)
+        full.run(30, 0.6, 2)
+        assert lean.data == full.data
+        assert lean.g.indices.dtype == np.int32
+
+
+@pytest.mark.slow
+def test_million_nodes_within_ceiling():
+    """ A 10^6 node network runs 50 ticks within 256 MiB, build included."""
+    result = bench.bench_memory(10**6, 'synchronous', 'distancing', 50,
+                                seed=0, ceiling_mb=256)
+    assert result['within_ceiling'], result
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+import workqueue
+
+
+def make_task(n):
+    """ Smallest task dictionary cache.task_key accepts."""
+    return {'backend': 'csr', 'mode': None, 'size': 10, 'p_infect': 0.2,
+            'p_die': 0.01, 'init_infect': 0.01, 'conformity': 1.0,
+            'crowd': 2, 'len_of_sims': 5, 'record': False,
+            'stop_early': False, 'profile': False, 'replicates': [0],
+            'topology': None, 'seed': np.random.SeedSequence(n)}
+
+
+def test_process_runs_tasks_locally(tmp_path):
+    queue = workqueue.WorkQueue(str(tmp_path / 'q.db'))
+    tasks = [make_task(n) for n in (1, 2, 1)]
+    run = lambda task: task['seed'].entropy
+    finished = list(workqueue.process(queue, tasks, run, poll=0))
+    assert sorted(outcome for task, outcome in finished) == [1, 1, 2]
+    assert queue.counts() == {'done': 2}
+
+
+def test_expired_lease_is_retried_and_first_result_wins(tmp_path):
+    queue = workqueue.WorkQueue(str(tmp_path / 'q.db'), lease_seconds=-1)
+    task_id, = queue.submit([make_task(1)])
+    assert queue.lease('a')[0] == task_id
+    assert queue.lease('b')[0] == task_id
+
+    queue.complete(task_id, 'b', 'from b')
+    queue.complete(task_id, 'a', 'from a')
+    done, failed = queue.finished([task_id])
+    assert done == {task_id: 'from b'} and not failed
+    assert queue.lease('c') is None
+
+
+def test_lease_expiring_on_last_attempt_fails_task(tmp_path):
+    queue = workqueue.WorkQueue(str(tmp_path / 'q.db'), lease_seconds=-1,
+                                max_attempts=2)
+    task_id, = queue.submit([make_task(1)])
+    queue.lease('a')
+    queue.lease('b')
+    assert queue.lease('c') is None
+    assert queue.finished([task_id])[1] == {task_id: 'lease expired'}
+
+
+def test_failing_task_is_retried_then_requeued_on_submit(tmp_path):
+    queue = workqueue.WorkQueue(str(tmp_path / 'q.db'), max_attempts=2)
+    calls = []
+
+    def flaky(task):
+        calls.append(task)
+        if len(calls) <= 2:
+            raise ValueError('boom')
+        return 'ok'
+
+    with pytest.raises(RuntimeError, match='ValueError: boom'):
+        list(workqueue.process(queue, [make_task(1)], flaky, poll=0))
+    assert len(calls) == 2
+    assert queue.counts() == {'failed': 1}
+
+    finished = list(workqueue.process(queue, [make_task(1)], flaky, poll=0))
+    assert [outcome for task, outcome in finished] == ['ok']
@@ -0,0 +1,270 @@
+"""
+SQLite-backed task queue shared by a Simulations coordinator and workers.
+
+Start any number of workers on machines that see the queue file with
+`python -m workqueue QUEUE`; see Simulations for the coordinator side.
+"""
+
+import argparse
+import os
+import pickle
+import socket
+import sqlite3
+import time
+import cache
+import epidemic
+import simulations
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    task BLOB NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    error TEXT,
+    outcome BLOB
+)
+"""
+
+
+class WorkQueue:
+
+
+    """
+    Queue of simulation tasks with leases, retries and idempotent results.
+
+    A task is identified by the hash of what determines its output, see
+    cache.task_key, so submitting the same task twice, from a rerun or a
+    second coordinator, adds nothing and picks up its stored result. As
+    with a strict ResultCache, the hash covers the model source, so results
+    stored before an edit to the model are not reused. Submitting a task
+    that failed gives it a fresh set of attempts.
+
+    Workers lease one task at a time. A lease that runs out before the task
+    is completed, because its worker died or lost the machine, makes the
+    task available again, and a task that failed or lost its lease
+    max_attempts times is marked failed. The first result stored for a task
+    wins; later completions of the same task, from a worker whose lease had
+    expired, are ignored.
+
+    SQLite locking is only as reliable as the file system the queue lives
+    on, which makes this a stand-in for a real broker on network shares.
+
+    Args:
+        path [str]: SQLite database file, created when missing.
+        lease_seconds [float]: time a worker has to finish a leased task.
+            Must exceed the longest task.
+        max_attempts [int]: leases a task gets before it is marked failed.
+
+    Attributes:
+        path [str]: SQLite database file.
+        version [str]: model version and source fingerprint in every id.
+        db [Connection]: connection in autocommit mode.
+    """
+
+
+    def __init__(self, path, lease_seconds=600.0, max_attempts=3):
+        """ Open the queue, creating its table if needed."""
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.version = '%s-%s' % (epidemic.MODEL_VERSION,
+                                cache.source_fingerprint())
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(SCHEMA)
+
+    def close(self):
+        """ Closes the connection."""
+        self.db.close()
+
+    def task_id(self, task):
+        """ Identifier of a task, shared by every identical submission."""
+        return cache.task_key(task, self.version)
+
+    def submit(self, tasks):
+        """ Adds the tasks not already queued and requeues those that
+        failed, returns the id of each."""
+        ids = [self.task_id(task) for task in tasks]
+        self.db.executemany("INSERT OR IGNORE INTO tasks (id, task) "
+                            "VALUES (?, ?)",
+                            [(i, pickle.dumps(task, pickle.HIGHEST_PROTOCOL))
+                            for i, task in zip(ids, tasks)])
+        for n in range(0, len(ids), 500):
+            chunk = ids[n:n + 500]
+            self.db.execute("UPDATE tasks SET state = 'pending', attempts = 0, "
+                            "worker = NULL, lease_until = NULL "
+                            "WHERE state = 'failed' AND id IN (%s)"
+                            % ','.join('?' * len(chunk)), chunk)
+        return ids
+
+    def lease(self, worker):
+        """ (id, task) of the next available task leased to worker, or None."""
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.db.execute("UPDATE tasks SET state = 'failed', "
+                            "error = 'lease expired' WHERE state = 'leased' "
+                            "AND lease_until < ? AND attempts >= ?",
+                            (now, self.max_attempts))
+            row = self.db.execute("SELECT id, task FROM tasks "
+                                "WHERE state = 'pending' OR (state = 'leased' "
+                                "AND lease_until < ?) ORDER BY rowid LIMIT 1",
+                                (now,)).fetchone()
+            if row is not None:
+                self.db.execute("UPDATE tasks SET state = 'leased', "
+                                "attempts = attempts + 1, worker = ?, "
+                                "lease_until = ? WHERE id = ?",
+                                (worker, now + self.lease_seconds, row[0]))
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+
+        if row is None:
+            return None
+        return row[0], pickle.loads(row[1])
+
+    def complete(self, task_id, worker, outcome):
+        """ Stores the outcome of a task unless one is already stored."""
+        self.db.execute("UPDATE tasks SET state = 'done', outcome = ?, "
+                        "worker = ?, error = NULL "
+                        "WHERE id = ? AND state != 'done'",
+                        (pickle.dumps(outcome, pickle.HIGHEST_PROTOCOL),
+                        worker, task_id))
+
+    def fail(self, task_id, worker, error):
+        """ Returns a task worker could not finish to the queue, or fails it
+        for good once it has used up its attempts."""
+        self.db.execute("UPDATE tasks SET error = ?, worker = NULL, "
+                        "state = CASE WHEN attempts >= ? THEN 'failed' "
+                        "ELSE 'pending' END "
+                        "WHERE id = ? AND state = 'leased' AND worker = ?",
+                        (error, self.max_attempts, task_id, worker))
+
+    def finished(self, ids):
+        """ Outcomes of the done tasks among ids, and errors of failed ones."""
+        done, failed = {}, {}
+        ids = list(ids)
+        for n in range(0, len(ids), 500):
+            chunk = ids[n:n + 500]
+            rows = self.db.execute("SELECT id, state, outcome, error "
+                                "FROM tasks WHERE state IN ('done', 'failed') "
+                                "AND id IN (%s)" % ','.join('?' * len(chunk)),
+                                chunk)
+            for task_id, state, outcome, error in rows:
+                if state == 'done':
+                    done[task_id] = pickle.loads(outcome)
+                else:
+                    failed[task_id] = error
+        return done, failed
+
+    def counts(self):
+        """ Number of tasks in each state."""
+        return dict(self.db.execute("SELECT state, COUNT(*) FROM tasks "
+                                    "GROUP BY state").fetchall())
+
+    def drained(self):
+        """ Whether no task is waiting or being worked on."""
+        counts = self.counts()
+        return not counts.get('pending') and not counts.get('leased')
+
+
+def worker_name():
+    """ Name identifying this process across machines."""
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def handle(queue, run, worker):
+    """ Leases and runs one task, returns False if none was available."""
+    leased = queue.lease(worker)
+    if leased is None:
+        return False
+
+    task_id, task = leased
+    try:
+        outcome = run(task)
+    except Exception as e:
+        queue.fail(task_id, worker, '%s: %s' % (type(e).__name__, e))
+    else:
+        queue.complete(task_id, worker, outcome)
+    return True
+
+
+def work(queue, run, worker=None, poll=1.0, idle_timeout=None):
+    """ Leases and runs tasks until the queue is drained.
+
+    With idle_timeout, keeps waiting that many seconds for new tasks after
+    the queue runs dry instead of stopping straight away. Returns the
+    number of tasks handled.
+    """
+    worker = worker or worker_name()
+    handled = 0
+    idle_since = None
+    while True:
+        if handle(queue, run, worker):
+            handled += 1
+            idle_since = None
+            continue
+
+        now = time.time()
+        if idle_since is None:
+            idle_since = now
+        if idle_timeout is None and queue.drained() \
+                or idle_timeout is not None \
+                and now - idle_since > idle_timeout:
+            return handled
+        time.sleep(poll)
+
+
+def process(queue, tasks, run, local=True, poll=1.0):
+    """ Yields (task, outcome) for every task as its result is stored.
+
+    Submits the tasks and collects their results from whichever workers
+    run them. With local set, the calling process also works on the queue
+    whenever nothing new has finished, so it completes on its own if no
+    other worker is running.
+    """
+    worker = worker_name()
+    waiting = {}
+    for task_id, task in zip(queue.submit(tasks), tasks):
+        waiting.setdefault(task_id, []).append(task)
+
+    while waiting:
+        done, failed = queue.finished(waiting)
+        if failed:
+            task_id, error = next(iter(failed.items()))
+            raise RuntimeError("task %s failed: %s" % (task_id, error))
+
+        for task_id, outcome in done.items():
+            for task in waiting.pop(task_id):
+                yield task, outcome
+
+        if not done and waiting:
+            if not local or not handle(queue, run, worker):
+                time.sleep(poll)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run simulation tasks "
+                                    "from a work queue.")
+    parser.add_argument('queue', help="SQLite queue file")
+    parser.add_argument('--lease', type=float, default=600.0,
+                        help="seconds a task may take before it is retried")
+    parser.add_argument('--attempts', type=int, default=3)
+    parser.add_argument('--poll', type=float, default=1.0)
+    parser.add_argument('--idle-timeout', type=float,
+                        help="seconds to wait for new tasks once the queue "
+                            "is drained")
+    args = parser.parse_args(argv)
+
+    queue = WorkQueue(args.queue, args.lease, args.attempts)
+    handled = work(queue, simulations.run_task, poll=args.poll,
+                idle_timeout=args.idle_timeout)
+    print("%s handled %d tasks" % (worker_name(), handled))
+
+
+if __name__ == '__main__':
+    main()